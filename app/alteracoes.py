@@ -0,0 +1,74 @@
+"""
+Registro de alterações para os caches incrementais do dashboard.
+
+A cada flush da sessão, edições e exclusões de exames, e inclusões, edições
+e exclusões de alunos e escolas, viram linhas na tabela `alteracao` (na
+mesma transação). O dashboard guarda o último `seq` lido e busca só o que
+mudou depois dele; exames novos ele acha pelo id_exame (marca d'água), por
+isso não são registrados aqui.
+
+Cargas em lote (importação, migração do legado) só inserem exames e alunos
+novos, que o dashboard detecta pela marca d'água e pelo total em
+resumo_escola. Atualizações em massa fora do ORM (ex.: reclassificação da
+triagem) usam `registrar`.
+
+As linhas antigas podem ser apagadas com `podar` (um cache que ficou para
+trás do que foi podado simplesmente recarrega tudo):
+    flask --app app podar-alteracoes --dias 7
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event
+
+from models import Aluno, Alteracao, Escola, Exame
+
+_tabela = Alteracao.__table__
+
+# modelo -> (nome registrado, atributo da PK, registra inclusões?)
+RASTREADOS = {
+    Exame: ('exame', 'id_exame', False),
+    Aluno: ('aluno', 'id_aluno', True),
+    Escola: ('escola', 'id_escola', True),
+}
+
+
+def _registros(sessao):
+    agora = datetime.now()
+    for colecao, operacao in ((sessao.new, 'I'), (sessao.dirty, 'U'), (sessao.deleted, 'D')):
+        for obj in colecao:
+            rastreado = RASTREADOS.get(type(obj))
+            if rastreado is None:
+                continue
+            tabela, pk, inclusoes = rastreado
+            if operacao == 'I' and not inclusoes:
+                continue
+            if operacao == 'U' and not sessao.is_modified(obj, include_collections=False):
+                continue
+            yield {'tabela': tabela, 'id_registro': getattr(obj, pk),
+                   'operacao': operacao, 'em': agora}
+
+
+def _depois_flush(sessao, contexto):
+    linhas = list(_registros(sessao))
+    if linhas:
+        sessao.connection().execute(_tabela.insert(), linhas)
+
+
+def registrar(conexao, tabela, ids, operacao='U'):
+    """Registra alterações feitas fora do ORM (ex.: UPDATE em massa)."""
+    agora = datetime.now()
+    linhas = [{'tabela': tabela, 'id_registro': int(i), 'operacao': operacao, 'em': agora}
+              for i in ids]
+    if linhas:
+        conexao.execute(_tabela.insert(), linhas)
+
+
+def init_alteracoes(db):
+    """Registra as alterações a cada flush da sessão do Flask-SQLAlchemy."""
+    event.listen(db.session, 'after_flush', _depois_flush)
+
+
+def podar(conexao, dias=7):
+    """Apaga marcadores com mais de `dias` dias; retorna quantos foram apagados."""
+    limite = datetime.now() - timedelta(days=dias)
+    return conexao.execute(delete(_tabela).where(_tabela.c.em < limite)).rowcount
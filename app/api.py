@@ -0,0 +1,270 @@
+"""
+API de análise (somente leitura, JSON) com os mesmos filtros do dashboard.
+
+    GET /api                   lista dos endpoints
+    GET /api/kpis              totais: exames, alunos, indicados e etapas da jornada
+    GET /api/series/mensal     mesmas métricas por mês
+    GET /api/regioes           por região administrativa
+    GET /api/escolas           por escola (com a taxa de entrega de óculos)
+    GET /api/criticos          alunos indicados p/ exame, paginado (?pagina=, ?por_pagina=)
+
+Filtros (query string, todos opcionais): regiao e id_escola (repetíveis:
+?regiao=Gama&regiao=Sobradinho), data_inicio e data_fim (AAAA-MM-DD, fim
+inclusivo). Valores inválidos respondem 400.
+
+Os números vêm das consultas de dados.consultas (kpis, série, região e
+escola saem de uma única consulta `painel`). As respostas ficam num cache
+LRU com validade (API_CACHE_ITENS entradas, API_CACHE_TTL_S segundos) por
+processo, com chave nos parâmetros normalizados: a ordem dos parâmetros,
+repetições e parâmetros desconhecidos não geram outra entrada. Cada resposta
+leva um ETag (hash do corpo); com If-None-Match igual a resposta é 304, sem
+corpo.
+
+Gravações feitas por este processo (commit da sessão com algo gravado)
+esvaziam o cache; as feitas por fora (dashboard, comandos) aparecem em até
+API_CACHE_TTL_S segundos.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import event
+
+from dados import consultas
+from models import db
+
+
+class CacheRespostas:
+    """Cache LRU com validade por entrada; seguro entre threads."""
+
+    def __init__(self, itens=256, ttl=60):
+        self.itens = itens
+        self.ttl = ttl
+        self._dados = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave, calcular):
+        """Valor de `chave`; calcula (fora do lock) e guarda se ausente ou vencido."""
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is not None and entrada[0] > agora:
+                self._dados.move_to_end(chave)
+                self.acertos += 1
+                return entrada[1]
+            self.faltas += 1
+        valor = calcular()
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.itens:
+                self._dados.popitem(last=False)
+        return valor
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+cache = CacheRespostas()
+
+
+class ParametroInvalido(ValueError):
+    pass
+
+
+# --------------------
+# PARÂMETROS
+# --------------------
+
+
+def _data(nome):
+    bruto = request.args.get(nome, '').strip()
+    if not bruto:
+        return None
+    try:
+        return datetime.strptime(bruto, '%Y-%m-%d').date()
+    except ValueError:
+        raise ParametroInvalido(f"{nome}: use o formato AAAA-MM-DD.")
+
+
+def _filtros():
+    """consultas.Filtros normalizado (listas ordenadas e sem repetição) da query string."""
+    regioes = sorted({r.strip() for r in request.args.getlist('regiao') if r.strip()})
+    try:
+        escolas = sorted({int(i) for i in request.args.getlist('id_escola') if i.strip()})
+    except ValueError:
+        raise ParametroInvalido("id_escola: use ids numéricos.")
+    inicio, fim = _data('data_inicio'), _data('data_fim')
+    if inicio and fim and inicio > fim:
+        raise ParametroInvalido("data_inicio posterior a data_fim.")
+    return consultas.Filtros(regioes=tuple(regioes) or None, escolas=tuple(escolas) or None,
+                             inicio=inicio, fim=fim)
+
+
+def _inteiro(nome, padrao, minimo=1, maximo=None):
+    try:
+        valor = int(request.args.get(nome, padrao))
+    except ValueError:
+        raise ParametroInvalido(f"{nome}: use um número inteiro.")
+    if valor < minimo:
+        raise ParametroInvalido(f"{nome}: mínimo {minimo}.")
+    return min(valor, maximo) if maximo else valor
+
+
+def _descrever(filtros):
+    return {
+        'regiao': list(filtros.regioes or []),
+        'id_escola': list(filtros.escolas or []),
+        'data_inicio': filtros.inicio.isoformat() if filtros.inicio else None,
+        'data_fim': filtros.fim.isoformat() if filtros.fim else None,
+    }
+
+
+# --------------------
+# DADOS
+# --------------------
+
+
+def _ler(nome, filtros):
+    """Resultado de consultas.<nome> para `filtros`, pelo cache."""
+    def calcular():
+        with db.engine.connect() as conexao:
+            return getattr(consultas, nome)(conexao, filtros)
+    return cache.obter(('consulta', nome, filtros), calcular)
+
+
+def _painel(filtros):
+    """(totais, por_regiao, por_escola, por_mes) de consultas.resumo_painel."""
+    return cache.obter(('resumo_painel', filtros),
+                       lambda: consultas.resumo_painel(_ler('painel', filtros)))
+
+
+def _registros(df, datas=()):
+    """Linhas de `df` como dicts JSON (datas ISO, nulos como None)."""
+    df = df.copy()
+    for coluna, formato in datas:
+        df[coluna] = df[coluna].dt.strftime(formato)
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+def _kpis(filtros, args):
+    totais = _painel(filtros)[0]
+    necessitam = totais['necessidade_oculos']
+    taxa = 100.0 * totais['oculos_entregue'] / necessitam if necessitam else 0.0
+    return {'kpis': dict(totais, taxa_entrega=round(taxa, 2))}
+
+
+def _mensal(filtros, args):
+    return {'meses': _registros(_painel(filtros)[3], [('mes', '%Y-%m')])}
+
+
+def _regioes(filtros, args):
+    return {'regioes': _registros(_painel(filtros)[1])}
+
+
+def _escolas(filtros, args):
+    por_escola = _painel(filtros)[2].round({'taxa_entrega': 2})
+    return {'escolas': _registros(por_escola)}
+
+
+def _criticos(filtros, args):
+    pagina, por_pagina = args
+    df = _ler('alunos_criticos', filtros)
+    inicio = (pagina - 1) * por_pagina
+    return {
+        'total': len(df),
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+        'alunos': _registros(df.iloc[inicio:inicio + por_pagina],
+                             [('data_exame', '%Y-%m-%dT%H:%M:%S')]),
+    }
+
+
+def _args_criticos():
+    return (_inteiro('pagina', 1),
+            _inteiro('por_pagina', current_app.config['ITENS_POR_PAGINA'],
+                     maximo=current_app.config['ITENS_POR_PAGINA_MAX']))
+
+
+# caminho -> (função, leitura dos parâmetros além dos filtros, descrição)
+ENDPOINTS = {
+    '/api/kpis': (_kpis, None, "Totais de exames, alunos, indicados e etapas da jornada."),
+    '/api/series/mensal': (_mensal, None, "Métricas por mês (alunos no mês do 1º exame)."),
+    '/api/regioes': (_regioes, None, "Métricas por região administrativa."),
+    '/api/escolas': (_escolas, None, "Métricas por escola e taxa de entrega de óculos."),
+    '/api/criticos': (_criticos, _args_criticos,
+                      "Alunos indicados p/ exame, com a jornada (paginado)."),
+}
+
+
+# --------------------
+# RESPOSTAS
+# --------------------
+
+
+def _responder(caminho):
+    funcao, ler_args, _ = ENDPOINTS[caminho]
+    try:
+        filtros = _filtros()
+        args = ler_args() if ler_args else ()
+    except ParametroInvalido as e:
+        return jsonify(erro=str(e)), 400
+
+    def montar():
+        dados = dict(funcao(filtros, args), filtros=_descrever(filtros))
+        corpo = json.dumps(dados, ensure_ascii=False, sort_keys=True).encode()
+        return corpo, hashlib.sha1(corpo).hexdigest()
+
+    corpo, etag = cache.obter(('resposta', caminho, filtros, args), montar)
+    resposta = Response(corpo, mimetype='application/json')
+    resposta.set_etag(etag)
+    resposta.cache_control.max_age = current_app.config['API_CACHE_TTL_S']
+    return resposta.make_conditional(request)
+
+
+def indice():
+    return jsonify(endpoints={caminho: descricao
+                              for caminho, (_, _, descricao) in ENDPOINTS.items()},
+                   filtros=['regiao', 'id_escola', 'data_inicio', 'data_fim'])
+
+
+# --------------------
+# INVALIDAÇÃO
+# --------------------
+
+
+def _depois_flush(sessao, contexto):
+    sessao.info['api_gravou'] = True
+
+
+def _depois_commit(sessao):
+    if sessao.info.pop('api_gravou', False):
+        cache.limpar()
+
+
+def _depois_rollback(sessao, transacao):
+    sessao.info.pop('api_gravou', None)
+
+
+def init_api(app):
+    """Registra as rotas /api e a limpeza do cache a cada commit com gravações."""
+    app.config.setdefault('API_CACHE_ITENS', 256)
+    app.config.setdefault('API_CACHE_TTL_S', 60)
+    cache.itens = app.config['API_CACHE_ITENS']
+    cache.ttl = app.config['API_CACHE_TTL_S']
+
+    app.add_url_rule('/api', 'api_indice', indice)
+    for caminho in ENDPOINTS:
+        nome = 'api_' + caminho[len('/api/'):].replace('/', '_')
+        app.add_url_rule(caminho, nome, lambda caminho=caminho: _responder(caminho))
+
+    event.listen(db.session, 'after_flush', _depois_flush)
+    event.listen(db.session, 'after_commit', _depois_commit)
+    event.listen(db.session, 'after_soft_rollback', _depois_rollback)
@@ -0,0 +1,372 @@
+"""
+Benchmark das rotas Flask e do dashboard Streamlit em tamanhos fixos de base.
+
+Para cada tamanho (por padrão 10k, 100k e 1M exames) o banco é recriado com
+gerador_dados.py (seed fixa) e são medidos:
+
+  - rotas Flask (via test client, sem rede): GET /alunos, /exames, /escolas,
+    POST /formulario e as rotas de edição (GET e POST);
+  - dashboard (app/dash/streamlit_app.py executado com streamlit AppTest):
+    execução fria (caches e snapshot da base local descartados), execução
+    quente (rerun) e cada consulta SQL disparada pelo script.
+
+Para cada medida: p50/p95/média de latência (ms), número de statements SQL e
+pico de memória Python (tracemalloc, medido numa execução extra para não
+distorcer os tempos). O resultado vai para um JSON de baseline; com
+--comparar, as diferenças de p95 em relação a outro baseline são listadas.
+
+ATENÇÃO: o banco de --db é APAGADO (exame/aluno/escola) a cada tamanho.
+
+Uso:
+    python benchmark.py --db postgresql+psycopg2://u:s@localhost:5432/bench
+    python benchmark.py --tamanhos 10000 --repeticoes 5 --saida /tmp/bench.json
+    python benchmark.py --comparar benchmark_baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import gerador_dados
+
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+DIR_DASH = os.path.join(DIR_APP, 'dash')
+
+TAMANHOS_PADRAO = (10000, 100000, 1000000)
+
+
+# --------------------
+# CONTADORES DE SQL (todas as engines do processo: Flask e Streamlit)
+# --------------------
+
+
+class ContadorSQL:
+    def __init__(self):
+        self.statements = 0
+        self.por_statement = {}  # sql normalizado -> [tempos em ms]
+        self._inicio = {}
+
+    def reset(self):
+        self.statements = 0
+        self.por_statement = {}
+
+    def antes(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self._inicio[id(cursor)] = time.perf_counter()
+
+    def depois(self, conn, cursor, statement, parameters, context, executemany):
+        inicio = self._inicio.pop(id(cursor), None)
+        if inicio is not None:
+            chave = re.sub(r'\s+', ' ', statement).strip()[:160]
+            self.por_statement.setdefault(chave, []).append(
+                (time.perf_counter() - inicio) * 1000)
+
+
+contador = ContadorSQL()
+event.listen(Engine, 'before_cursor_execute', contador.antes)
+event.listen(Engine, 'after_cursor_execute', contador.depois)
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p / 100
+    baixo = int(k)
+    alto = min(baixo + 1, len(ordenados) - 1)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (k - baixo)
+
+
+def _resumo(tempos_ms, statements=None, pico_kb=None):
+    resumo = {
+        'n': len(tempos_ms),
+        'p50_ms': round(_percentil(tempos_ms, 50), 3),
+        'p95_ms': round(_percentil(tempos_ms, 95), 3),
+        'media_ms': round(sum(tempos_ms) / len(tempos_ms), 3),
+    }
+    if statements is not None:
+        resumo['sql_statements'] = statements
+    if pico_kb is not None:
+        resumo['pico_memoria_kb'] = pico_kb
+    return resumo
+
+
+@contextmanager
+def _pico_memoria(resultado):
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        resultado['pico_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+
+
+def medir(func, repeticoes, aquecimento=1):
+    """Executa func várias vezes; retorna o resumo com latência, SQL e memória."""
+    for _ in range(aquecimento):
+        func()
+    tempos = []
+    statements = []
+    for _ in range(repeticoes):
+        contador.reset()
+        inicio = time.perf_counter()
+        func()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        statements.append(contador.statements)
+    memoria = {}
+    with _pico_memoria(memoria):
+        func()
+    return _resumo(tempos, max(statements), memoria['pico_kb'])
+
+
+# --------------------
+# ROTAS FLASK
+# --------------------
+
+
+def _valor(v):
+    """Valor do campo do formulário: vazio só para None (0.0 é medida válida)."""
+    return '' if v is None else v
+
+
+def _form_exame(exame, prefixo_se='SE_Direito'):
+    campos = {
+        'InputDataHoraEscaneamento': '2024-06-01T10:00',
+        'raio_corneano_od_mm': _valor(exame.raio_corneano_od_mm),
+        'eixo_querato_steeper_od': _valor(exame.eixo_querato_steeper_od),
+        'eixo_querato_flatter_od': _valor(exame.eixo_querato_flatter_od),
+        prefixo_se: _valor(exame.se_direito),
+        'DS_Direito': _valor(exame.ds_direito),
+        'DC_Direito': _valor(exame.dc_direito),
+        'Axis_Direito': _valor(exame.axis_direito),
+        'distancia_interpupilar_mm': _valor(exame.distancia_interpupilar_mm),
+        'SE_Esquerdo': _valor(exame.se_esquerdo),
+        'DS_Esquerdo': _valor(exame.ds_esquerdo),
+        'DC_Esquerdo': _valor(exame.dc_esquerdo),
+        'Axis_Esquerdo': _valor(exame.axis_esquerdo),
+        'raio_corneano_os_mm': _valor(exame.raio_corneano_os_mm),
+        'eixo_querato_steeper_os': _valor(exame.eixo_querato_steeper_os),
+        'eixo_querato_flatter_os': _valor(exame.eixo_querato_flatter_os),
+    }
+    return {k: str(v) for k, v in campos.items()}
+
+
+def medir_rotas(modulo_app, repeticoes):
+    from models import db, Aluno, Escola, Exame
+
+    flask_app = modulo_app.app
+    cliente = flask_app.test_client()
+    with flask_app.app_context():
+        exame = Exame.query.order_by(Exame.id_exame).first()
+        aluno = db.session.get(Aluno, exame.id_aluno)
+        escola = db.session.get(Escola, aluno.id_escola)
+        form_exame = _form_exame(exame)
+        form_exame['id_aluno'] = str(exame.id_aluno)
+        form_novo = _form_exame(exame, prefixo_se='Input9')
+        form_novo['aluno_id'] = str(exame.id_aluno)
+        form_aluno = {
+            'nome': aluno.nome,
+            'data_nascimento': aluno.data_nascimento.isoformat(),
+            'sexo': aluno.sexo,
+            'id_escola': str(aluno.id_escola),
+            'regiao_administrativa': aluno.regiao_administrativa,
+        }
+        form_escola = {c: ('' if getattr(escola, c) is None else str(getattr(escola, c)))
+                       for c in ('nome', 'logradouro', 'numero', 'complemento', 'bairro',
+                                 'cidade', 'estado', 'cep', 'regiao_administrativa',
+                                 'latitude', 'longitude')}
+        id_exame, id_aluno, id_escola = exame.id_exame, aluno.id_aluno, escola.id_escola
+
+    def get(url):
+        return lambda: _checar(cliente.get(url))
+
+    def post(url, dados):
+        return lambda: _checar(cliente.post(url, data=dados))
+
+    rotas = {
+        'GET /alunos': get('/alunos'),
+        'GET /exames': get('/exames'),
+        'GET /escolas': get('/escolas'),
+        'POST /formulario': post('/formulario', form_novo),
+        'GET /exames/editar': get(f'/exames/editar/{id_exame}'),
+        'POST /exames/editar': post(f'/exames/editar/{id_exame}', form_exame),
+        'GET /alunos/editar': get(f'/alunos/editar/{id_aluno}'),
+        'POST /alunos/editar': post(f'/alunos/editar/{id_aluno}', form_aluno),
+        'GET /escolas/editar': get(f'/escolas/editar/{id_escola}'),
+        'POST /escolas/editar': post(f'/escolas/editar/{id_escola}', form_escola),
+    }
+    resultados = {}
+    for nome, func in rotas.items():
+        resultados[nome] = medir(func, repeticoes)
+        print(f"  {nome:<24} p50={resultados[nome]['p50_ms']:>9.1f}ms "
+              f"p95={resultados[nome]['p95_ms']:>9.1f}ms sql={resultados[nome]['sql_statements']}")
+    return resultados
+
+
+def _checar(resposta):
+    if resposta.status_code >= 400:
+        raise RuntimeError(f"{resposta.request.path} respondeu {resposta.status_code}")
+    return resposta
+
+
+# --------------------
+# DASHBOARD STREAMLIT
+# --------------------
+
+
+def medir_dashboard(repeticoes):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    cwd = os.getcwd()
+    os.chdir(DIR_DASH)  # o dashboard abre regions.geojson relativo ao diretório
+    try:
+        def executar():
+            at = AppTest.from_file(os.path.join(DIR_DASH, 'streamlit_app.py'),
+                                   default_timeout=600)
+            at.run()
+            if at.exception:
+                raise RuntimeError(f"dashboard falhou: {at.exception[0].message}")
+            return at
+
+        def fria():
+            # a base local (DASH_FONTE=local) fica no cache_resource e no
+            # snapshot em disco: os dois são descartados junto com os dados
+            st.cache_data.clear()
+            st.cache_resource.clear()
+            shutil.rmtree(os.environ['DASH_SNAPSHOT_DIR'], ignore_errors=True)
+            executar()
+
+        resultados = {'execucao_fria': medir(fria, repeticoes)}
+
+        # consultas SQL feitas na execução fria (tempo de cada load_data)
+        consultas = {}
+        for _ in range(repeticoes):
+            contador.reset()
+            fria()
+            for sql, tempos in contador.por_statement.items():
+                consultas.setdefault(sql, []).extend(tempos)
+        resultados['consultas'] = {sql: _resumo(t) for sql, t in consultas.items()}
+
+        # execução quente: caches preenchidos, custo do pipeline pandas + render
+        executar()
+        resultados['execucao_quente'] = medir(executar, repeticoes, aquecimento=0)
+    finally:
+        os.chdir(cwd)
+
+    for nome in ('execucao_fria', 'execucao_quente'):
+        r = resultados[nome]
+        print(f"  dashboard {nome:<15} p50={r['p50_ms']:>9.1f}ms "
+              f"p95={r['p95_ms']:>9.1f}ms sql={r['sql_statements']}")
+    return resultados
+
+
+# --------------------
+# COMPARAÇÃO
+# --------------------
+
+
+def _achatar(resultados, prefixo=''):
+    for chave, valor in resultados.items():
+        if isinstance(valor, dict) and 'p95_ms' in valor:
+            yield f"{prefixo}{chave}", valor
+        elif isinstance(valor, dict):
+            yield from _achatar(valor, f"{prefixo}{chave} / ")
+
+
+def comparar(atual, baseline, limiar=0.2, minimo_ms=1.0):
+    """
+    Lista as medidas cujo p95 mudou mais que `limiar` (20%) em relação ao
+    baseline, ignorando diferenças menores que `minimo_ms` (ruído).
+    """
+    antigos = dict(_achatar(baseline['tamanhos']))
+    regressoes = 0
+    for nome, medida in _achatar(atual['tamanhos']):
+        antigo = antigos.get(nome)
+        if not antigo:
+            continue
+        variacao = (medida['p95_ms'] - antigo['p95_ms']) / max(antigo['p95_ms'], 1e-9)
+        if abs(variacao) >= limiar and abs(medida['p95_ms'] - antigo['p95_ms']) >= minimo_ms:
+            regressoes += variacao > 0
+            print(f"{'PIOROU ' if variacao > 0 else 'MELHOROU'} {variacao:+7.1%}  {nome} "
+                  f"({antigo['p95_ms']:.1f} -> {medida['p95_ms']:.1f} ms)")
+    return regressoes
+
+
+# --------------------
+# MAIN
+# --------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das rotas Flask e do dashboard.")
+    parser.add_argument('--db', default=os.environ.get('BENCH_DATABASE_URL', 'sqlite:///benchmark.db'),
+                        help="banco de benchmark (SERÁ APAGADO). Padrão: $BENCH_DATABASE_URL "
+                             "ou sqlite:///benchmark.db")
+    parser.add_argument('--tamanhos', default=','.join(map(str, TAMANHOS_PADRAO)),
+                        help="quantidades de exames, separadas por vírgula")
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sem-dashboard', action='store_true', help="mede só as rotas Flask")
+    parser.add_argument('--saida', default='benchmark_baseline.json')
+    parser.add_argument('--comparar', help="baseline JSON anterior para comparar os p95")
+    args = parser.parse_args(argv)
+
+    # o app Flask e o dashboard leem a URI do banco de DATABASE_URL; o snapshot
+    # do dashboard vai para uma pasta temporária, não para app/dash/snapshot
+    os.environ['DATABASE_URL'] = args.db
+    os.environ['DASH_SNAPSHOT_DIR'] = tempfile.mkdtemp(prefix='benchmark-snapshot-')
+    sys.path.insert(0, DIR_APP)
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'banco': args.db.split(':', 1)[0],
+        'python': platform.python_version(),
+        'repeticoes': args.repeticoes,
+        'seed': args.seed,
+        'tamanhos': {},
+    }
+    modulo_app = None
+    try:
+        for n_exames in (int(t) for t in args.tamanhos.split(',')):
+            n_alunos = max(n_exames // 5, 1)
+            n_escolas = max(n_exames // 3000, 20)
+            print(f"\n== {n_exames} exames / {n_alunos} alunos / {n_escolas} escolas ==")
+            gerador_dados.gerar(args.db, n_escolas, n_alunos, n_exames, seed=args.seed,
+                                workers=args.workers, limpar=True)
+            if modulo_app is None:
+                import app as modulo_app  # importa só depois do DATABASE_URL definido
+
+            medidas = {'rotas': medir_rotas(modulo_app, args.repeticoes)}
+            if not args.sem_dashboard:
+                medidas['dashboard'] = medir_dashboard(args.repeticoes)
+            resultado['tamanhos'][str(n_exames)] = medidas
+    finally:
+        shutil.rmtree(os.environ['DASH_SNAPSHOT_DIR'], ignore_errors=True)
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"\nBaseline gravado em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            return 1 if comparar(resultado, json.load(f)) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,9 @@
+"""
+Acesso a dados compartilhado pelo app Flask e pelo dashboard Streamlit.
+
+  - conexao: URI, pool e cache de SQL compilado (um orçamento de conexões
+    por processo, as mesmas opções nos dois lados);
+  - consultas: consultas de leitura canônicas (SQLAlchemy Core sobre as
+    tabelas de models.py), com os filtros do dashboard.
+"""
+from dados.conexao import URI_PADRAO, criar_engine, opcoes_engine, uri
@@ -0,0 +1,371 @@
+"""
+Consultas de leitura canônicas, compartilhadas pelo dashboard e pelo app.
+
+Montadas com o SQLAlchemy Core sobre as tabelas de models.py (não há SQL em
+texto com nomes de colunas repetidos em cada módulo). Convertem as seleções
+da barra lateral (regiões, escolas, intervalo de datas) em predicados
+parametrizados e devolvem só o que os gráficos usam: os agregados vêm
+prontos do banco e as listas por aluno/exame já chegam filtradas.
+
+Todos os valores entram como parâmetros (as listas de IN como "expanding"),
+então cada consulta compila uma vez por engine e fica no cache de SQL
+compilado (ver dados.conexao), qualquer que seja o filtro.
+
+Convenção dos filtros (ver Filtros):
+  - regioes / escolas = None  -> sem restrição (ex.: tudo selecionado)
+  - tupla vazia               -> nada selecionado (resultado vazio)
+  - inicio / fim (date)       -> intervalo fechado de datas de exame
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import (Date, case, cast, func, literal, literal_column, null, select,
+                        true, tuple_, union_all)
+
+from models import ETAPAS_JORNADA, Alteracao, Aluno, Escola, Exame, JornadaAluno, ResumoEscola
+
+Filtros = namedtuple('Filtros', ['regioes', 'escolas', 'inicio', 'fim'])
+Filtros.__new__.__defaults__ = (None, None, None, None)
+
+_exame = Exame.__table__
+_aluno = Aluno.__table__
+_escola = Escola.__table__
+_jornada = JornadaAluno.__table__
+
+# colunas da junção exame ⨝ aluno ⨝ escola, com os nomes usados no dashboard
+COLUNAS_EXAME = {
+    'id_exame': _exame.c.id_exame,
+    'id_aluno': _exame.c.id_aluno,
+    'aluno': _aluno.c.nome,
+    'id_escola': _aluno.c.id_escola,
+    'escola': _escola.c.nome,
+    'regiao': _escola.c.regiao_administrativa,
+    'data_exame': _exame.c.data_hora_escaneamento,
+    'esferico_od': _exame.c.se_direito,
+    'cilindrico_od': _exame.c.ds_direito,
+    'esferico_os': _exame.c.se_esquerdo,
+    'cilindrico_os': _exame.c.ds_esquerdo,
+    'critico': _exame.c.critico,
+}
+
+_JUNCAO = (_exame.join(_aluno, _aluno.c.id_aluno == _exame.c.id_aluno)
+           .join(_escola, _escola.c.id_escola == _aluno.c.id_escola))
+
+# status "Crítico": classificação gravada pelo app com as regras de triagem
+# (faixa etária, dois olhos; ver app/triagem.py)
+CRITICO = _exame.c.critico == true()
+
+_DATA = _exame.c.data_hora_escaneamento
+# 1º exame do aluno: mais antigo, exames sem data por último
+_ORDEM_EXAMES = (_DATA.is_(None), _DATA, _exame.c.id_exame)
+
+
+def colunas(*nomes):
+    """Colunas de COLUNAS_EXAME rotuladas com o nome (todas, sem `nomes`)."""
+    return [COLUNAS_EXAME[n].label(n) for n in (nomes or COLUNAS_EXAME)]
+
+
+def exames(*nomes):
+    """SELECT das `colunas` sobre a junção exame ⨝ aluno ⨝ escola."""
+    return select(*colunas(*nomes)).select_from(_JUNCAO)
+
+
+def _condicoes(filtros):
+    """Predicados correspondentes a `filtros`."""
+    condicoes = []
+    if filtros.regioes is not None:
+        condicoes.append(_escola.c.regiao_administrativa.in_(list(filtros.regioes)))
+    if filtros.escolas is not None:
+        condicoes.append(_escola.c.id_escola.in_([int(i) for i in filtros.escolas]))
+    if filtros.inicio is not None:
+        condicoes.append(_DATA >= pd.Timestamp(filtros.inicio).to_pydatetime())
+    if filtros.fim is not None:
+        # fim inclusivo: até o início do dia seguinte
+        condicoes.append(_DATA < (pd.Timestamp(filtros.fim) + timedelta(days=1)).to_pydatetime())
+    return condicoes
+
+
+def _filtrar(stmt, filtros, *extra):
+    return stmt.where(*_condicoes(filtros), *extra)
+
+
+def _ler(conexao, stmt):
+    return pd.read_sql(stmt, conexao)
+
+
+def inicio_do_mes(dialeto, coluna):
+    """
+    1º dia do mês de `coluna`. Constantes no SQL (não parâmetros), para o
+    GROUP BY repetir a mesma expressão do SELECT.
+    """
+    if dialeto == 'postgresql':
+        return cast(func.date_trunc(literal_column("'month'"), coluna), Date)
+    if dialeto == 'sqlite':
+        return func.date(coluna, literal_column("'start of month'"))
+    if dialeto in ('mysql', 'mariadb'):
+        return cast(func.date_format(coluna, literal_column("'%Y-%m-01'")), Date)
+    raise NotImplementedError(f"banco não suportado: {dialeto}")
+
+
+# --------------------
+# VERSÃO DOS DADOS
+# --------------------
+
+
+def versao(conexao):
+    """
+    Marcador barato (três buscas por índice) que muda quando os dados mudam:
+    exames/alunos novos pelo maior id, edições e exclusões pelo registro de
+    alterações que o app grava. Usado como chave de cache no lugar do TTL.
+    """
+    return tuple(conexao.execute(select(
+        select(func.max(_exame.c.id_exame)).scalar_subquery(),
+        select(func.max(_aluno.c.id_aluno)).scalar_subquery(),
+        select(func.max(Alteracao.__table__.c.seq)).scalar_subquery(),
+    )).one())
+
+
+# --------------------
+# OPÇÕES DA BARRA LATERAL (não dependem dos filtros)
+# --------------------
+
+
+def escolas(conexao):
+    """Escolas com região, coordenadas e total de alunos (do resumo_escola)."""
+    resumo = ResumoEscola.__table__
+    df = _ler(conexao, select(
+        _escola.c.id_escola, _escola.c.nome.label('escola'),
+        _escola.c.regiao_administrativa.label('regiao'),
+        func.coalesce(resumo.c.alunos, 0).label('total_alunos'),
+        _escola.c.latitude, _escola.c.longitude,
+    ).select_from(_escola.outerjoin(resumo, resumo.c.id_escola == _escola.c.id_escola)))
+    df["total_alunos"] = pd.to_numeric(df["total_alunos"], errors="coerce").fillna(0).astype(int)
+    return df
+
+
+def limites_datas(conexao):
+    """(primeira, última) data de exame, como date; (None, None) sem exames."""
+    df = _ler(conexao, select(func.min(_DATA).label('inicio'), func.max(_DATA).label('fim')))
+    inicio, fim = pd.to_datetime(df.loc[0, "inicio"]), pd.to_datetime(df.loc[0, "fim"])
+    if pd.isna(inicio):
+        return None, None
+    return inicio.date(), fim.date()
+
+
+# --------------------
+# AGREGADOS FILTRADOS
+# --------------------
+
+
+def kpis(conexao, filtros):
+    """Alunos triados e alunos indicados p/ exame (status crítico), distintos por id."""
+    id_aluno = _exame.c.id_aluno
+    df = _ler(conexao, _filtrar(select(
+        func.count(id_aluno.distinct()).label('alunos_triados'),
+        func.count(case((CRITICO, id_aluno)).distinct()).label('indicadas'),
+    ).select_from(_JUNCAO), filtros))
+    return {c: int(df.loc[0, c] or 0) for c in df.columns}
+
+
+def exames_por_escola(conexao, filtros):
+    return _ler(conexao, _filtrar(
+        select(_escola.c.nome.label('escola'), func.count().label('total_exames'))
+        .select_from(_JUNCAO), filtros)
+        .group_by(_escola.c.id_escola, _escola.c.nome))
+
+
+def exames_por_regiao(conexao, filtros):
+    """Total de exames e médias de esférico/cilíndrico (OD) por região."""
+    regiao = _escola.c.regiao_administrativa
+    return _ler(conexao, _filtrar(select(
+        regiao.label('regiao'),
+        func.count().label('total_exames'),
+        func.avg(_exame.c.se_direito).label('esferico_od'),
+        func.avg(_exame.c.ds_direito).label('cilindrico_od'),
+    ).select_from(_JUNCAO), filtros).group_by(regiao))
+
+
+def exames_por_mes(conexao, filtros):
+    mes = inicio_do_mes(conexao.dialect.name, _DATA)
+    df = _ler(conexao, _filtrar(
+        select(mes.label('data_exame'), func.count().label('qtde')).select_from(_JUNCAO),
+        filtros, _DATA.isnot(None)).group_by(mes).order_by(mes))
+    df["data_exame"] = pd.to_datetime(df["data_exame"])
+    return df
+
+
+# --------------------
+# LISTAS FILTRADAS
+# --------------------
+
+
+def _critico_aluno():
+    """1 se algum exame do aluno (no filtro) é crítico."""
+    return func.max(case((CRITICO, 1), else_=0)).over(partition_by=_exame.c.id_aluno)
+
+
+def _ordem_aluno():
+    """Posição do exame entre os do aluno (no filtro); 1 = 1º exame."""
+    return func.row_number().over(partition_by=_exame.c.id_aluno, order_by=_ORDEM_EXAMES)
+
+
+def primeiro_exame_por_aluno(conexao, filtros):
+    """
+    Uma linha por aluno (id_aluno, como a jornada_aluno) com a data do 1º
+    exame no filtro, a escola/região desse exame e se algum exame do aluno no
+    filtro é crítico.
+    """
+    nomes = ('aluno', 'data_exame', 'id_aluno', 'id_escola', 'escola', 'regiao')
+    primeiros = _filtrar(select(
+        *colunas(*nomes),
+        _critico_aluno().label('critico'),
+        _ordem_aluno().label('ordem'),
+    ).select_from(_JUNCAO), filtros).subquery('primeiros')
+    df = _ler(conexao, select(*[primeiros.c[n] for n in (*nomes, 'critico')])
+              .where(primeiros.c.ordem == 1))
+    df["data_exame"] = pd.to_datetime(df["data_exame"])
+    df["critico"] = df["critico"].astype(bool)
+    return df
+
+
+def alunos_criticos(conexao, filtros):
+    """
+    Alunos indicados p/ exame (algum exame crítico no filtro), um por linha,
+    com o 1º exame no filtro (data, escola, região, medidas) e as etapas da
+    jornada (False sem registro). Ordem: data do 1º exame, id_aluno.
+    """
+    nomes = ('id_aluno', 'aluno', 'data_exame', 'id_escola', 'escola', 'regiao',
+             'esferico_od', 'cilindrico_od', 'esferico_os', 'cilindrico_os')
+    primeiros = _filtrar(select(
+        *colunas(*nomes),
+        _critico_aluno().label('critico'),
+        _ordem_aluno().label('ordem'),
+    ).select_from(_JUNCAO), filtros).subquery('primeiros')
+    df = _ler(conexao, select(
+        *[primeiros.c[n] for n in nomes],
+        *[func.coalesce(_jornada.c[f], False).label(f) for f in ETAPAS_JORNADA],
+    ).select_from(primeiros.outerjoin(_jornada, _jornada.c.id_aluno == primeiros.c.id_aluno))
+        .where(primeiros.c.ordem == 1, primeiros.c.critico == 1)
+        .order_by(primeiros.c.data_exame.is_(None), primeiros.c.data_exame,
+                  primeiros.c.id_aluno))
+    df["data_exame"] = pd.to_datetime(df["data_exame"])
+    df[list(ETAPAS_JORNADA)] = df[list(ETAPAS_JORNADA)].astype(bool)
+    return df
+
+
+def exames_criticos(conexao, filtros):
+    """Exames com status crítico, com o nome do aluno e as medidas dos dois olhos."""
+    df = _ler(conexao, _filtrar(
+        exames('id_aluno', 'aluno', 'data_exame', 'esferico_od', 'cilindrico_od',
+               'esferico_os', 'cilindrico_os'), filtros, CRITICO)
+        .order_by(_DATA, _exame.c.id_exame))
+    df["data_exame"] = pd.to_datetime(df["data_exame"])
+    return df
+
+
+# --------------------
+# PAINEL DE KPIs (aba 1)
+# --------------------
+# Uma consulta devolve todos os números da aba: totais e quebras por região,
+# escola e mês, num único GROUP BY GROUPING SETS (no PostgreSQL; nos bancos
+# sem GROUPING SETS, um UNION ALL dos mesmos agrupamentos, ainda numa ida ao
+# banco). As métricas por aluno contam cada aluno uma vez, no seu 1º exame no
+# filtro (mesma convenção de primeiro_exame_por_aluno); `exames` conta todos.
+
+# nível -> colunas agrupadas (as demais vêm nulas)
+NIVEIS_PAINEL = {
+    "total": (),
+    "regiao": ("regiao",),
+    "escola": ("regiao", "id_escola", "escola"),
+    "mes": ("mes",),
+}
+COLUNAS_PAINEL = ("regiao", "id_escola", "escola", "mes")
+METRICAS_PAINEL = ("exames", "alunos", "indicadas", *ETAPAS_JORNADA)
+
+
+def _metricas_painel(tabela):
+    """Agregados de METRICAS_PAINEL sobre `tabela` (primeiro, critico e etapas como 0/1)."""
+    c = tabela.c
+    return [
+        func.count().label("exames"),
+        func.sum(c.primeiro).label("alunos"),
+        func.sum(c.primeiro * c.critico).label("indicadas"),
+        *[func.sum(c[f]).label(f) for f in ETAPAS_JORNADA],
+    ]
+
+
+def _agrupar_painel(tabela, grouping_sets=True):
+    """SELECT dos NIVEIS_PAINEL sobre `tabela`, com a coluna `nivel`."""
+    agrupadas = [tabela.c[c] for c in COLUNAS_PAINEL]
+    if grouping_sets:
+        # GROUPING(...) tem um bit por coluna (a 1ª é o bit mais alto),
+        # ligado quando a coluna não é agrupada no nível
+        casos = {int("".join("0" if c in colunas_nivel else "1" for c in COLUNAS_PAINEL), 2):
+                 literal_column(f"'{nivel}'")
+                 for nivel, colunas_nivel in NIVEIS_PAINEL.items()}
+        conjuntos = [tuple_(*[tabela.c[c] for c in colunas_nivel])
+                     for colunas_nivel in NIVEIS_PAINEL.values()]
+        return (select(case(casos, value=func.grouping(*agrupadas)).label("nivel"),
+                       *agrupadas, *_metricas_painel(tabela))
+                .group_by(func.grouping_sets(*conjuntos)))
+    partes = []
+    for nivel, colunas_nivel in NIVEIS_PAINEL.items():
+        selecao = [tabela.c[c] if c in colunas_nivel else null().label(c) for c in COLUNAS_PAINEL]
+        partes.append(select(literal(nivel).label("nivel"), *selecao, *_metricas_painel(tabela))
+                      .group_by(*[tabela.c[c] for c in colunas_nivel]))
+    return union_all(*partes)
+
+
+def painel(conexao, filtros):
+    """Totais e quebras (NIVEIS_PAINEL) de exames, alunos, indicados e etapas da jornada."""
+    dialeto = conexao.dialect.name
+    filtrados = _filtrar(select(
+        *colunas("regiao", "id_escola", "escola"),
+        inicio_do_mes(dialeto, _DATA).label("mes"),
+        _exame.c.id_aluno,
+        case((_ordem_aluno() == 1, 1), else_=0).label("primeiro"),
+        _critico_aluno().label("critico"),
+    ).select_from(_JUNCAO), filtros).cte("exames")
+    # etapas contadas só no 1º exame do aluno
+    base = select(
+        filtrados,
+        *[case((_jornada.c[f], filtrados.c.primeiro), else_=0).label(f) for f in ETAPAS_JORNADA],
+    ).select_from(filtrados.outerjoin(_jornada, _jornada.c.id_aluno == filtrados.c.id_aluno)
+                  ).cte("painel")
+    df = _ler(conexao, _agrupar_painel(base, grouping_sets=dialeto == "postgresql"))
+    df["mes"] = pd.to_datetime(df["mes"])
+    return df
+
+
+def resumo_painel(df):
+    """
+    Separa o resultado de `painel` em (totais, por_regiao, por_escola, por_mes):
+      - totais: dict exames, alunos, indicadas e uma chave por etapa (ETAPAS_JORNADA)
+      - por_regiao: regiao ("Sem Região" no lugar de nula) + métricas
+      - por_escola: regiao, id_escola, escola + métricas + taxa_entrega (%)
+      - por_mes: mes (do 1º exame do aluno) + métricas; sem os exames sem data
+    """
+    metricas = list(METRICAS_PAINEL)
+    df = df.copy()
+    df[metricas] = df[metricas].fillna(0).astype(int)
+    niveis = {nivel: grupo.reset_index(drop=True) for nivel, grupo in df.groupby("nivel")}
+    vazio = df.iloc[:0]
+
+    total = niveis.get("total", vazio)
+    totais = {m: int(total[m].sum()) for m in metricas}
+
+    por_regiao = niveis.get("regiao", vazio)[["regiao", *metricas]]
+    por_regiao = por_regiao.sort_values("regiao", na_position="last", ignore_index=True)
+    por_regiao["regiao"] = por_regiao["regiao"].astype(object).fillna("Sem Região")
+
+    por_escola = niveis.get("escola", vazio)[["regiao", "id_escola", "escola", *metricas]]
+    por_escola = por_escola.sort_values("escola", na_position="last", ignore_index=True)
+    por_escola["id_escola"] = por_escola["id_escola"].astype(int)
+    necessitam = por_escola["necessidade_oculos"]
+    por_escola["taxa_entrega"] = (
+        (por_escola["oculos_entregue"] / necessitam.where(necessitam > 0)).mul(100).fillna(0.0))
+
+    por_mes = niveis.get("mes", vazio)[["mes", *metricas]]
+    por_mes = por_mes[por_mes["mes"].notna()].sort_values("mes", ignore_index=True)
+    return totais, por_regiao, por_escola, por_mes
@@ -0,0 +1,108 @@
+"""
+Avisos de mudança nos dados via LISTEN/NOTIFY do PostgreSQL.
+
+A migração 8 (migracoes.py) cria triggers por statement em TABELAS que,
+a cada INSERT/UPDATE/DELETE/TRUNCATE, fazem NOTIFY no CANAL com o nome da
+tabela. O aviso só sai no commit e o PostgreSQL junta os repetidos da mesma
+transação: uma carga em lote de 1 milhão de exames vira um aviso.
+
+O Ouvinte mantém uma conexão própria (fora do pool) em LISTEN numa thread e
+conta, por tabela, quantos avisos chegaram (`geracao`). Quem guarda cache
+põe a geração das tabelas de que depende na chave: um aviso de
+jornada_aluno não invalida nada que dependa só de exames, e vice-versa. Se
+a conexão cai, a thread reconecta e incrementa todas as gerações (avisos
+podem ter se perdido no meio).
+
+Em outros bancos, ou sem psycopg2, `Ouvinte.iniciar` devolve None e quem
+usa continua consultando a versão dos dados periodicamente.
+"""
+import logging
+import select
+import threading
+
+log = logging.getLogger(__name__)
+
+CANAL = 'dados_alterados'
+TABELAS = ('exame', 'aluno', 'escola', 'jornada_aluno')
+
+# espera máxima por avisos antes de testar a conexão (s)
+ESPERA_S = 30
+# pausa antes de tentar reconectar (s)
+PAUSA_RECONEXAO_S = 5
+
+
+class Ouvinte:
+    """Thread em LISTEN no CANAL, com a geração de cada tabela e callbacks."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._geracoes = dict.fromkeys(TABELAS, 0)
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def iniciar(cls, engine):
+        """Ouvinte já escutando, ou None se o banco não tem LISTEN/NOTIFY (psycopg2)."""
+        if engine.dialect.name != 'postgresql' or engine.dialect.driver != 'psycopg2':
+            return None
+        ouvinte = cls(engine)
+        ouvinte._thread = threading.Thread(target=ouvinte._laco, name='ouvinte-notify',
+                                           daemon=True)
+        ouvinte._thread.start()
+        return ouvinte
+
+    def geracao(self, *tabelas):
+        """Tupla com a geração de cada uma de `tabelas`: muda a cada aviso delas."""
+        with self._lock:
+            return tuple(self._geracoes[t] for t in tabelas)
+
+    def inscrever(self, funcao):
+        """Chama `funcao(tabelas)` (set de nomes) a cada lote de avisos."""
+        self._callbacks.append(funcao)
+
+    def parar(self):
+        self._parar.set()
+
+    def _avisar(self, tabelas):
+        with self._lock:
+            for tabela in tabelas:
+                self._geracoes[tabela] = self._geracoes.get(tabela, 0) + 1
+        for funcao in self._callbacks:
+            try:
+                funcao(tabelas)
+            except Exception:
+                log.exception("falha ao tratar aviso de %s", sorted(tabelas))
+
+    def _escutar(self):
+        conexao = self.engine.raw_connection()
+        conexao.detach()  # a conexão fica presa no LISTEN: não volta ao pool
+        bruta = conexao.driver_connection
+        try:
+            bruta.autocommit = True
+            with bruta.cursor() as cursor:
+                cursor.execute(f"LISTEN {CANAL}")
+            # o que mudou antes do LISTEN (ou enquanto estava desconectado)
+            self._avisar(set(TABELAS))
+            while not self._parar.is_set():
+                if not select.select([bruta], [], [], ESPERA_S)[0]:
+                    with bruta.cursor() as cursor:
+                        cursor.execute("SELECT 1")  # conexão caída levanta erro aqui
+                    continue
+                bruta.poll()
+                tabelas = set()
+                while bruta.notifies:
+                    tabelas.add(bruta.notifies.pop(0).payload)
+                if tabelas:
+                    self._avisar(tabelas)
+        finally:
+            conexao.close()
+
+    def _laco(self):
+        while not self._parar.is_set():
+            try:
+                self._escutar()
+            except Exception:
+                log.exception("ouvinte de %s desconectado; reconectando", CANAL)
+                self._parar.wait(PAUSA_RECONEXAO_S)
@@ -0,0 +1,197 @@
+"""
+Motor de agregações do dashboard: DuckDB embutido, com pandas como reserva.
+
+As consultas da base local (mesmos nomes de dados/consultas.py / base_local.py)
+rodam como SQL no DuckDB direto sobre o DataFrame da BaseExames, sem cópia,
+em paralelo e vetorizado. `painel` (KPIs, funil, região, escola e mês da
+aba 1) é o mesmo GROUPING SETS de consultas.painel, com a jornada vinda do
+DataFrame de jornada.carregar.
+
+DASH_MOTOR=pandas (ou o duckdb não instalado) usa as implementações em
+pandas, com o mesmo resultado.
+"""
+import os
+import threading
+
+import pandas as pd
+
+import base_local
+import jornada
+from dados import consultas
+
+try:
+    import duckdb
+except ImportError:  # opcional
+    duckdb = None
+
+MOTOR = os.environ.get("DASH_MOTOR", "duckdb")
+
+FLAGS = jornada.FLAGS
+
+_local = threading.local()
+
+
+def usa_duckdb():
+    return MOTOR == "duckdb" and duckdb is not None
+
+
+def _conexao():
+    """Uma conexão DuckDB (em memória) por thread: conexões não são thread-safe."""
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _local.con = duckdb.connect()
+    return con
+
+
+def _sql(sql, tabelas, params=None):
+    con = _conexao()
+    for nome, df in tabelas.items():
+        con.register(nome, df)
+    try:
+        df = con.execute(sql, params or {}).df()
+    finally:
+        for nome in tabelas:
+            con.unregister(nome)
+    # colunas categóricas da base voltam como ENUM (categoria ordenada);
+    # devolve no mesmo tipo das funções em pandas
+    for coluna in df.select_dtypes("category"):
+        df[coluna] = df[coluna].cat.as_unordered()
+    return df
+
+
+# --------------------
+# CONSULTAS SOBRE A BASE LOCAL
+# --------------------
+
+
+CRITICO = "critico"
+
+
+def _where(filtros, extra=()):
+    condicoes, params = list(extra), {}
+    if filtros.regioes is not None:
+        condicoes.append("list_contains($regioes, regiao)")
+        params["regioes"] = list(filtros.regioes)
+    if filtros.escolas is not None:
+        condicoes.append("list_contains($escolas, id_escola)")
+        params["escolas"] = [int(i) for i in filtros.escolas]
+    if filtros.inicio is not None:
+        condicoes.append("data_exame >= $inicio")
+        params["inicio"] = pd.Timestamp(filtros.inicio).to_pydatetime()
+    if filtros.fim is not None:
+        condicoes.append("data_exame < $fim")
+        params["fim"] = (pd.Timestamp(filtros.fim) + pd.Timedelta(days=1)).to_pydatetime()
+    return ("WHERE " + " AND ".join(condicoes)) if condicoes else "", params
+
+
+def _exames(base, filtros, select, extra=(), resto=""):
+    where, params = _where(filtros, extra)
+    return _sql(f"{select} FROM exames {where} {resto}", {"exames": base.df}, params)
+
+
+def kpis(base, filtros):
+    df = _exames(base, filtros, f"""
+        SELECT COUNT(DISTINCT id_aluno) AS alunos_triados,
+               COUNT(DISTINCT CASE WHEN {CRITICO} THEN id_aluno END) AS indicadas""")
+    return {c: int(df.loc[0, c] or 0) for c in df.columns}
+
+
+def exames_por_escola(base, filtros):
+    return _exames(base, filtros, "SELECT escola, COUNT(*) AS total_exames",
+                   resto="GROUP BY id_escola, escola")
+
+
+def exames_por_regiao(base, filtros):
+    return _exames(base, filtros, """
+        SELECT regiao, COUNT(*) AS total_exames,
+               AVG(esferico_od) AS esferico_od, AVG(cilindrico_od) AS cilindrico_od""",
+                   resto="GROUP BY regiao ORDER BY regiao")
+
+
+def exames_por_mes(base, filtros):
+    return _exames(base, filtros,
+                   "SELECT CAST(date_trunc('month', data_exame) AS TIMESTAMP) AS data_exame, "
+                   "COUNT(*) AS qtde",
+                   extra=["data_exame IS NOT NULL"], resto="GROUP BY 1 ORDER BY 1")
+
+
+def primeiro_exame_por_aluno(base, filtros):
+    return _exames(base, filtros,
+                   "SELECT aluno, data_exame, id_aluno, id_escola, escola, regiao, "
+                   f"COALESCE(bool_or({CRITICO}) OVER (PARTITION BY id_aluno), false) AS critico",
+                   resto="QUALIFY ROW_NUMBER() OVER (PARTITION BY id_aluno "
+                         "ORDER BY data_exame NULLS LAST, id_exame) = 1")
+
+
+def exames_criticos(base, filtros):
+    return _exames(base, filtros,
+                   "SELECT id_aluno, aluno, data_exame, esferico_od, cilindrico_od, "
+                   "esferico_os, cilindrico_os",
+                   extra=[CRITICO], resto="ORDER BY data_exame, id_exame")
+
+
+def agrupar_painel(tabela):
+    """
+    SELECT dos consultas.NIVEIS_PAINEL sobre `tabela` (colunas
+    consultas.COLUNAS_PAINEL, primeiro, critico e FLAGS como 0/1), com a
+    coluna `nivel`.
+    """
+    colunas = ", ".join(consultas.COLUNAS_PAINEL)
+    metricas = ", ".join(["COUNT(*) AS exames", "SUM(primeiro) AS alunos",
+                          "SUM(primeiro * critico) AS indicadas",
+                          *[f"SUM({f}) AS {f}" for f in FLAGS]])
+    # GROUPING(...) tem um bit por coluna (a 1ª é o bit mais alto), ligado
+    # quando a coluna não é agrupada no nível
+    casos = []
+    for nivel, agrupadas in consultas.NIVEIS_PAINEL.items():
+        bits = "".join("0" if c in agrupadas else "1" for c in consultas.COLUNAS_PAINEL)
+        casos.append(f"WHEN {int(bits, 2)} THEN '{nivel}'")
+    conjuntos = ", ".join(f"({', '.join(agrupadas)})"
+                          for agrupadas in consultas.NIVEIS_PAINEL.values())
+    return f"""
+        SELECT CASE GROUPING({colunas}) {' '.join(casos)} END AS nivel, {colunas}, {metricas}
+        FROM {tabela}
+        GROUP BY GROUPING SETS ({conjuntos})
+    """
+
+
+def painel(base, filtros, estado):
+    """consultas.painel sobre a base local; `estado` é a jornada (jornada.carregar)."""
+    where, params = _where(filtros)
+    flags = ", ".join(f"CASE WHEN j.{f} THEN f.primeiro ELSE 0 END AS {f}" for f in FLAGS)
+    return _sql(f"""
+        WITH filtrados AS (
+            SELECT regiao, id_escola, escola,
+                   CAST(date_trunc('month', data_exame) AS TIMESTAMP) AS mes, id_aluno,
+                   CAST(ROW_NUMBER() OVER (PARTITION BY id_aluno
+                                           ORDER BY data_exame NULLS LAST, id_exame) = 1
+                        AS INTEGER) AS primeiro,
+                   CAST(COALESCE(bool_or({CRITICO}) OVER (PARTITION BY id_aluno), false)
+                        AS INTEGER) AS critico
+            FROM exames {where}
+        ),
+        painel AS (
+            SELECT f.*, {flags}
+            FROM filtrados f
+            LEFT JOIN jornada j ON j.id_aluno = f.id_aluno
+        )
+        {agrupar_painel("painel")}
+    """, {"exames": base.df, "jornada": estado}, params)
+
+
+_CONSULTAS = {
+    "kpis": kpis,
+    "exames_por_escola": exames_por_escola,
+    "exames_por_regiao": exames_por_regiao,
+    "exames_por_mes": exames_por_mes,
+    "primeiro_exame_por_aluno": primeiro_exame_por_aluno,
+    "exames_criticos": exames_criticos,
+    "painel": painel,
+}
+
+
+def local(nome):
+    """Função `nome` para a base local: DuckDB se disponível, senão pandas."""
+    if usa_duckdb() and nome in _CONSULTAS:
+        return _CONSULTAS[nome]
+    return getattr(base_local, nome)
@@ -0,0 +1,419 @@
+"""
+Cópia local (em memória) dos exames para o dashboard, atualizada por deltas.
+
+Em vez de jogar fora e reconsultar a junção exame ⨝ aluno ⨝ escola inteira a
+cada expiração de cache, a BaseExames guarda:
+  - a marca d'água: maior id_exame já carregado (exames novos vêm por
+    `id_exame > marca`);
+  - o último `seq` lido da tabela `alteracao`, que o app grava ao editar ou
+    excluir exames e ao mudar alunos/escolas (ver app/alteracoes.py), e as
+    lacunas abaixo dele: seqs ainda não vistos, de transações que commitaram
+    depois de uma com seq maior. Cada lacuna é relida nas atualizações
+    seguintes até aparecer ou passar de ESPERA_LACUNA_S (seq de uma
+    transação desfeita nunca aparece).
+
+Cada atualização custa duas consultas pequenas e traz só as linhas novas ou
+alteradas, que são mescladas no DataFrame. A recarga completa só acontece na
+primeira vez, quando o registro de alterações foi podado além do que a base
+leu, ou quando a verificação periódica (total de exames em resumo_escola x
+linhas locais) acusa divergência (ex.: id gerado por uma transação que
+terminou depois de uma mais nova).
+
+Com um diretório de snapshot (snapshot.py), a base sobe a partir do último
+Parquet gravado e só aplica os deltas desde ele; `iniciar` deixa uma thread
+em segundo plano buscando deltas e regravando o snapshot quando há mudanças,
+de modo que as reexecuções do Streamlit não esperam pelo banco. Com avisos
+do banco (dados/notificacoes.py), `acordar` faz a thread buscar os deltas na
+hora, e o intervalo vira só uma garantia contra avisos perdidos.
+
+As funções de consulta no fim do módulo têm os mesmos nomes das de
+dados/consultas.py, mas recebem a BaseExames no lugar da conexão e rodam em pandas
+sobre a cópia local.
+"""
+import logging
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import and_, func, or_, select
+
+import jornada
+import snapshot
+from dados import consultas
+from models import Alteracao, ResumoEscola
+
+log = logging.getLogger(__name__)
+
+# intervalo mínimo entre duas idas ao banco para buscar deltas
+INTERVALO_ATUALIZACAO_S = 5
+# o mesmo, quando o banco avisa das mudanças (a thread é acordada por `acordar`)
+INTERVALO_COM_AVISOS_S = 120
+# intervalo da verificação de consistência (contagem em resumo_escola)
+INTERVALO_VERIFICACAO_S = 600
+# intervalo mínimo entre duas gravações do snapshot
+INTERVALO_SNAPSHOT_S = 300
+# por quanto tempo um seq pulado em `alteracao` continua sendo procurado
+ESPERA_LACUNA_S = 600
+# seqs abaixo do lido numa recarga completa conferidos atrás de lacunas
+JANELA_LACUNAS = 1000
+
+
+# tipos da base em memória (aplicados em toda leitura, ver `compactar`): ids
+# int32, nomes repetidos como categoria (um código por linha + um dicionário
+# por valor distinto) e medidas em float32; reduz a memória de cada processo
+# do Streamlit e o custo de merges/groupbys
+TIPOS = {
+    "id_exame": "int32",
+    "id_aluno": "int32",
+    "aluno": "category",
+    "id_escola": "int32",
+    "escola": "category",
+    "regiao": "category",
+    "esferico_od": "float32",
+    "cilindrico_od": "float32",
+    "esferico_os": "float32",
+    "cilindrico_os": "float32",
+    # SQLite devolve 0/1, PostgreSQL True/False; NULL = sem medidas
+    "critico": "boolean",
+}
+CATEGORIAS = [c for c, t in TIPOS.items() if t == "category"]
+
+
+def compactar(df):
+    """Aplica TIPOS (e datetime64 em data_exame) às colunas que ainda não os têm."""
+    df = df.copy(deep=False)
+    if not pd.api.types.is_datetime64_any_dtype(df["data_exame"]):
+        df["data_exame"] = pd.to_datetime(df["data_exame"])
+    for coluna, tipo in TIPOS.items():
+        if df[coluna].dtype != tipo:
+            df[coluna] = df[coluna].astype(tipo)
+    for coluna in CATEGORIAS:
+        # categorias em ordem alfabética: ordenar/agrupar pela categoria dá a
+        # mesma ordem que pelo texto (o dicionário do Parquet vem na ordem de
+        # aparição)
+        categorias = df[coluna].cat.categories
+        if not categorias.is_monotonic_increasing:
+            df[coluna] = df[coluna].cat.reorder_categories(categorias.sort_values())
+    return df
+
+
+def _mesclar_tipos(df, novos):
+    """
+    Converte `novos` (bloco de deltas) para os dtypes de `df`. As categorias
+    de `df` ganham os valores que ainda não existiam (mantidas em ordem
+    alfabética); as que deixam de ser usadas só somem na próxima recarga.
+    """
+    for coluna in CATEGORIAS:
+        categorias = df[coluna].cat.categories
+        faltam = pd.Index(novos[coluna].dropna().unique()).difference(categorias)
+        if len(faltam):
+            df[coluna] = df[coluna].cat.set_categories(categorias.union(faltam))
+    return df, novos.astype(df.dtypes.to_dict())
+
+
+class BaseExames:
+    """Exames com aluno/escola/região em memória, com atualização incremental."""
+
+    def __init__(self, engine, diretorio_snapshot=None):
+        self.engine = engine
+        self.diretorio_snapshot = diretorio_snapshot
+        self.df = None
+        self.escolas = None
+        self.marca = 0        # maior id_exame carregado
+        self.seq = 0          # último seq de `alteracao` aplicado
+        self._lacunas = {}    # seq <= self.seq ainda não visto -> quando foi notado
+        self.versao = 0       # muda a cada alteração efetiva do df
+        self._consultado_em = 0.0
+        self._verificado_em = 0.0
+        self._versao_gravada = None
+        self._gravado_em = 0.0
+        self._thread = None
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+
+    # --- leitura do banco ---
+
+    def _ler(self, conn, *condicoes):
+        return compactar(pd.read_sql(consultas.exames().where(*condicoes), conn))
+
+    def _ultimo_seq(self, conn):
+        """(maior seq, menor seq) do registro; vazio -> (self.seq, None)."""
+        seq = Alteracao.__table__.c.seq
+        seq_max, seq_min = conn.execute(select(func.max(seq), func.min(seq))).one()
+        return (self.seq, None) if seq_max is None else (seq_max, seq_min)
+
+    def _recarregar(self, conn):
+        # o seq é lido antes dos dados: o que mudar no meio é reaplicado depois
+        seq, _ = self._ultimo_seq(conn)
+        df = self._ler(conn)
+        self.escolas = consultas.escolas(conn)
+        self.df = df
+        self.marca = int(df["id_exame"].max()) if not df.empty else 0
+        # transações ainda abertas na leitura deixam lacunas logo abaixo do seq
+        coluna = Alteracao.__table__.c.seq
+        self.seq = max(seq - JANELA_LACUNAS, 0)
+        self._lacunas = {}
+        self._atualizar_lacunas(set(conn.execute(
+            select(coluna).where(coluna > self.seq, coluna <= seq)).scalars()), seq)
+        self.seq = seq
+        self.versao += 1
+        self._verificado_em = time.monotonic()
+
+    def _do_snapshot(self):
+        """Carrega o snapshot local, se houver; os deltas vêm na sequência."""
+        if not self.diretorio_snapshot:
+            return False
+        inicio = time.perf_counter()
+        carregado = snapshot.carregar(self.diretorio_snapshot)
+        if carregado is None:
+            return False
+        df, self.escolas, self.marca, self.seq = carregado
+        # snapshots gravados antes de uma mudança em TIPOS
+        self.df = compactar(df)
+        self.versao += 1
+        self._versao_gravada = self.versao
+        self._gravado_em = time.monotonic()
+        log.info("base carregada do snapshot (%d exames) em %.0f ms",
+                 len(self.df), (time.perf_counter() - inicio) * 1000)
+        return True
+
+    def _aplicar_deltas(self, conn):
+        seq, seq_min = self._ultimo_seq(conn)
+        if seq_min is not None and seq_min > self.seq + 1:
+            # registros de que a base precisava já foram podados
+            self._recarregar(conn)
+            return
+
+        registro = Alteracao.__table__
+        intervalo = and_(registro.c.seq > self.seq, registro.c.seq <= seq)
+        if self._lacunas:
+            intervalo = or_(intervalo, registro.c.seq.in_(sorted(self._lacunas)))
+        alteracoes = conn.execute(
+            select(registro.c.seq, registro.c.tabela, registro.c.id_registro)
+            .where(intervalo)).all()
+        ids = {"exame": set(), "aluno": set(), "escola": set()}
+        for _, tabela, id_registro in alteracoes:
+            ids.setdefault(tabela, set()).add(id_registro)
+        self._atualizar_lacunas({s for s, _, _ in alteracoes}, seq)
+
+        c = consultas.COLUNAS_EXAME
+        condicoes = [c["id_exame"] > self.marca]
+        for tabela, coluna in (("exame", "id_exame"), ("aluno", "id_aluno"),
+                               ("escola", "id_escola")):
+            if ids[tabela]:
+                condicoes.append(c[coluna].in_(sorted(ids[tabela])))
+        novos = self._ler(conn, or_(*condicoes))
+
+        self.seq = seq
+        if novos.empty and not any(ids.values()):
+            return
+        # totais de alunos e região/nome das escolas podem ter mudado
+        self.escolas = consultas.escolas(conn)
+        # remove as versões antigas do que mudou (e o que foi excluído) e
+        # acrescenta as linhas atuais
+        # um bloco pequeno pode vir com tipos diferentes (ex.: coluna só de
+        # nulos) e com nomes fora das categorias da base
+        df, novos = _mesclar_tipos(self.df.copy(deep=False), novos)
+        fora = (df["id_exame"].isin(ids["exame"]) | df["id_aluno"].isin(ids["aluno"])
+                | df["id_escola"].isin(ids["escola"]) | df["id_exame"].isin(novos["id_exame"]))
+        self.df = pd.concat([df[~fora], novos], ignore_index=True)
+        if not novos.empty:
+            self.marca = max(self.marca, int(novos["id_exame"].max()))
+        self.versao += 1
+
+    def _atualizar_lacunas(self, lidos, seq):
+        """
+        Tira das lacunas os seqs `lidos`, acrescenta os que faltaram entre
+        self.seq e `seq` e esquece os procurados há mais de ESPERA_LACUNA_S.
+        Reaplicar um seq é inócuo: o delta relê a linha atual do registro.
+        """
+        agora = time.monotonic()
+        for s in lidos:
+            self._lacunas.pop(s, None)
+        for s in range(self.seq + 1, seq + 1):
+            if s not in lidos:
+                self._lacunas[s] = agora
+        self._lacunas = {s: desde for s, desde in self._lacunas.items()
+                         if agora - desde < ESPERA_LACUNA_S}
+
+    def _consistente(self, conn):
+        total = conn.execute(
+            select(func.coalesce(func.sum(ResumoEscola.__table__.c.exames), 0))).scalar()
+        return int(total) == len(self.df)
+
+    # --- API ---
+
+    def atualizar(self, forcar=False):
+        """
+        Traz as mudanças desde a última chamada (no máximo a cada
+        INTERVALO_ATUALIZACAO_S) e devolve a versão atual da base, que serve
+        de chave de cache para tudo que for calculado a partir dela. Com a
+        thread de `iniciar` rodando, só devolve a versão.
+        """
+        agora = time.monotonic()
+        if not forcar and self.df is not None and (
+                self._thread is not None or agora - self._consultado_em < INTERVALO_ATUALIZACAO_S):
+            return self.versao
+        with self._lock:
+            if self.df is None and self._do_snapshot():
+                agora = time.monotonic()
+            with self.engine.connect() as conn:
+                if self.df is None:
+                    self._recarregar(conn)
+                else:
+                    self._aplicar_deltas(conn)
+                    if agora - self._verificado_em >= INTERVALO_VERIFICACAO_S:
+                        if not self._consistente(conn):
+                            self._recarregar(conn)
+                        self._verificado_em = agora
+            self._consultado_em = time.monotonic()
+        return self.versao
+
+    def gravar_snapshot(self, forcar=False):
+        """Grava o snapshot se a base mudou desde a última gravação."""
+        if not self.diretorio_snapshot or self.df is None:
+            return False
+        with self._lock:
+            if not forcar and self._versao_gravada == self.versao:
+                return False
+            df, escolas, marca, seq, versao = (self.df, self.escolas, self.marca,
+                                               self.seq, self.versao)
+        snapshot.gravar(df, escolas, marca, seq, self.diretorio_snapshot)
+        self._versao_gravada = versao
+        self._gravado_em = time.monotonic()
+        return True
+
+    def _laco(self, intervalo):
+        while True:
+            self._acordar.wait(intervalo)
+            self._acordar.clear()
+            try:
+                self.atualizar(forcar=True)
+                if time.monotonic() - self._gravado_em >= INTERVALO_SNAPSHOT_S:
+                    self.gravar_snapshot()
+            except Exception:
+                log.exception("falha ao atualizar a base local")
+
+    def iniciar(self, intervalo=INTERVALO_ATUALIZACAO_S):
+        """
+        Carrega a base (do snapshot, se houver) e inicia a thread que busca
+        deltas a cada `intervalo` segundos e regrava o snapshot periodicamente.
+        """
+        self.atualizar(forcar=True)
+        if self.diretorio_snapshot and self._versao_gravada is None:
+            self.gravar_snapshot()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._laco, args=(intervalo,),
+                                            name="base-local", daemon=True)
+            self._thread.start()
+        return self
+
+    def acordar(self):
+        """Faz a thread de `iniciar` buscar os deltas agora (ex.: aviso de mudança)."""
+        self._acordar.set()
+
+
+# --------------------
+# CONSULTAS SOBRE A CÓPIA LOCAL (mesma interface de consultas.py)
+# --------------------
+
+
+def _critico(df):
+    return df["critico"].fillna(False).astype(bool)
+
+
+def _filtrar(df, filtros):
+    mascara = pd.Series(True, index=df.index)
+    if filtros.regioes is not None:
+        mascara &= df["regiao"].isin(filtros.regioes)
+    if filtros.escolas is not None:
+        mascara &= df["id_escola"].isin(filtros.escolas)
+    if filtros.inicio is not None:
+        mascara &= df["data_exame"] >= pd.Timestamp(filtros.inicio)
+    if filtros.fim is not None:
+        mascara &= df["data_exame"] < pd.Timestamp(filtros.fim) + pd.Timedelta(days=1)
+    return df[mascara]
+
+
+def escolas(base):
+    return base.escolas
+
+
+def limites_datas(base):
+    datas = base.df["data_exame"].dropna()
+    if datas.empty:
+        return None, None
+    return datas.min().date(), datas.max().date()
+
+
+def kpis(base, filtros):
+    f = _filtrar(base.df, filtros)
+    return {"alunos_triados": int(f["id_aluno"].nunique()),
+            "indicadas": int(f.loc[_critico(f), "id_aluno"].nunique())}
+
+
+def exames_por_escola(base, filtros):
+    f = _filtrar(base.df, filtros)
+    return (f.groupby(["id_escola", "escola"], observed=True).size()
+            .reset_index(name="total_exames")[["escola", "total_exames"]])
+
+
+def exames_por_regiao(base, filtros):
+    f = _filtrar(base.df, filtros)
+    return (f.groupby("regiao", observed=True)
+            .agg(total_exames=("id_exame", "size"),
+                 esferico_od=("esferico_od", "mean"),
+                 cilindrico_od=("cilindrico_od", "mean"))
+            .reset_index())
+
+
+def exames_por_mes(base, filtros):
+    f = _filtrar(base.df, filtros)
+    f = f[f["data_exame"].notna()]
+    serie = f.groupby(f["data_exame"].dt.to_period("M")).size().reset_index(name="qtde")
+    serie["data_exame"] = serie["data_exame"].dt.to_timestamp()
+    return serie
+
+
+def primeiro_exame_por_aluno(base, filtros):
+    f = _filtrar(base.df, filtros)
+    primeiros = (f.sort_values(["data_exame", "id_exame"], na_position="last")
+                 .drop_duplicates("id_aluno"))
+    criticos = f.loc[_critico(f), "id_aluno"].unique()
+    primeiros = primeiros.assign(critico=primeiros["id_aluno"].isin(criticos))
+    return primeiros[["aluno", "data_exame", "id_aluno", "id_escola", "escola", "regiao",
+                      "critico"]].reset_index(drop=True)
+
+
+def exames_criticos(base, filtros):
+    f = _filtrar(base.df, filtros)
+    f = f[_critico(f)].sort_values(["data_exame", "id_exame"])
+    return f[["id_aluno", "aluno", "data_exame", "esferico_od", "cilindrico_od",
+              "esferico_os", "cilindrico_os"]].reset_index(drop=True)
+
+
+def painel(base, filtros, estado):
+    """consultas.painel em pandas; `estado` é a jornada (jornada.carregar)."""
+    f = _filtrar(base.df, filtros)
+    primeiros = (f.sort_values(["data_exame", "id_exame"], na_position="last")
+                 .drop_duplicates("id_aluno").index)
+    x = f[["regiao", "id_escola", "escola", "id_aluno"]].assign(
+        mes=f["data_exame"].dt.to_period("M").dt.to_timestamp(),
+        primeiro=f.index.isin(primeiros).astype(int),
+        critico=f["id_aluno"].isin(f.loc[_critico(f), "id_aluno"].unique()).astype(int))
+    etapas = (x[["id_aluno"]].merge(estado, on="id_aluno", how="left")[jornada.FLAGS]
+              .fillna(False).astype(int).to_numpy())
+    x[jornada.FLAGS] = etapas * x[["primeiro"]].to_numpy()
+    x["indicadas"] = x["primeiro"] * x["critico"]
+
+    metricas = {"exames": ("id_aluno", "size"), "alunos": ("primeiro", "sum"),
+                "indicadas": ("indicadas", "sum"), **{c: (c, "sum") for c in jornada.FLAGS}}
+    partes = []
+    for nivel, colunas in consultas.NIVEIS_PAINEL.items():
+        if colunas:
+            parte = (x.groupby(list(colunas), dropna=False, observed=True)
+                     .agg(**metricas).reset_index())
+        else:
+            parte = pd.DataFrame([{m: x[c].agg(op) for m, (c, op) in metricas.items()}])
+        partes.append(parte.assign(nivel=nivel))
+    return pd.concat(partes, ignore_index=True)
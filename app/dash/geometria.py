@@ -0,0 +1,252 @@
+"""
+Geometrias das regiões administrativas (regions.geojson) para o mapa do
+dashboard.
+
+O GeoJSON original tem ~100 mil vértices (2,8 MB) e ia inteiro, a cada
+reexecução, do disco para o json.load e do Plotly para o navegador. A
+MapaRegioes lê o arquivo uma vez por processo, guarda versões simplificadas
+em alguns níveis de tolerância (em graus; 0.001 ≈ 110 m) e indexa as
+features por `properties.ra`, de modo que montar o mapa é só escolher as
+features do nível desejado.
+
+A simplificação preserva a topologia entre regiões vizinhas: os anéis são
+quebrados em trechos nas junções (vértices cujos vizinhos diferem entre os
+anéis que o contêm) e cada trecho é simplificado uma única vez
+(Douglas-Peucker, com as pontas fixas). A fronteira comum a duas regiões
+sai idêntica nas duas, sem buracos nem sobreposições no mapa; onde a
+simplificação faria um contorno cruzar outro, os vértices originais do
+trecho voltam, até não haver cruzamento.
+"""
+import json
+from collections import defaultdict
+
+import numpy as np
+
+CAMINHO_PADRAO = "regions.geojson"
+# níveis pré-calculados (graus); 0 = geometria original
+TOLERANCIAS = (0.0002, 0.0005, 0.001)
+TOLERANCIA_PADRAO = 0.0005
+# casas decimais das coordenadas enviadas ao navegador (~10 cm)
+CASAS = 6
+
+
+def _poligonos(geometria):
+    if geometria["type"] == "Polygon":
+        return [geometria["coordinates"]]
+    return geometria["coordinates"]
+
+
+def _anel(coordenadas):
+    """Anel aberto (sem repetir o 1º ponto no fim) e sem pontos consecutivos iguais."""
+    pontos = [tuple(p[:2]) for p in coordenadas]
+    aberto = [p for i, p in enumerate(pontos) if i == 0 or p != pontos[i - 1]]
+    if len(aberto) > 1 and aberto[0] == aberto[-1]:
+        aberto.pop()
+    return aberto
+
+
+def _juncoes(aneis):
+    """Vértices em que os trechos se quebram: vizinhos diferentes entre ocorrências."""
+    vizinhos = defaultdict(set)
+    for anel in aneis:
+        n = len(anel)
+        for i, p in enumerate(anel):
+            vizinhos[p].add(frozenset((anel[i - 1], anel[(i + 1) % n])))
+    return {p for p, v in vizinhos.items() if len(v) > 1}
+
+
+def _trechos(anel, juncoes):
+    """Quebra o anel (aberto) em trechos que começam e terminam em junções."""
+    inicios = [i for i, p in enumerate(anel) if p in juncoes]
+    if not inicios:
+        # anel sem junções (ilha, ou anel inteiro compartilhado): começa no
+        # menor ponto, para que as duas ocorrências gerem o mesmo trecho
+        inicio = anel.index(min(anel))
+        return [anel[inicio:] + anel[:inicio + 1]]
+    girado = anel[inicios[0]:] + anel[:inicios[0]]
+    cortes = [i - inicios[0] for i in inicios] + [len(anel)]
+    girado.append(girado[0])
+    return [girado[a:b + 1] for a, b in zip(cortes, cortes[1:])]
+
+
+def _canonico(trecho):
+    """(trecho no sentido canônico, se foi invertido): o mesmo trecho visto dos dois lados."""
+    if (trecho[0], trecho[1]) <= (trecho[-1], trecho[-2]):
+        return tuple(trecho), False
+    return tuple(reversed(trecho)), True
+
+
+def _mais_distante(pontos, i, j):
+    """Índice (entre i e j, exclusive) do ponto mais distante do segmento i-j, e a distância."""
+    a, trecho = pontos[i], pontos[i + 1:j]
+    dx, dy = pontos[j] - a
+    norma = np.hypot(dx, dy)
+    if norma == 0:  # trecho fechado: distância até a ponta
+        distancias = np.hypot(trecho[:, 0] - a[0], trecho[:, 1] - a[1])
+    else:
+        distancias = np.abs(dx * (trecho[:, 1] - a[1]) - dy * (trecho[:, 0] - a[0])) / norma
+    k = int(distancias.argmax())
+    return k + i + 1, distancias[k]
+
+
+def _douglas_peucker(pontos, tolerancia):
+    """Máscara dos pontos mantidos (array n x 2); as duas pontas sempre ficam."""
+    manter = np.zeros(len(pontos), dtype=bool)
+    manter[0] = manter[-1] = True
+    pilha = [(0, len(pontos) - 1)]
+    while pilha:
+        i, j = pilha.pop()
+        if j <= i + 1:
+            continue
+        k, distancia = _mais_distante(pontos, i, j)
+        if distancia > tolerancia:
+            manter[k] = True
+            pilha += [(i, k), (k, j)]
+    return manter
+
+
+def _cruzamentos(segmentos):
+    """
+    Índices dos segmentos (array n x 4: x1, y1, x2, y2) que cruzam algum
+    outro; pontas comuns e segmentos colineares não contam.
+    """
+    a, b = segmentos[:, None, :2], segmentos[:, None, 2:]
+    c, d = segmentos[None, :, :2], segmentos[None, :, 2:]
+
+    def lado(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+                       - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+    cruza = (lado(a, b, c) * lado(a, b, d) < 0) & (lado(c, d, a) * lado(c, d, b) < 0)
+    return np.flatnonzero(cruza.any(axis=1))
+
+
+class MapaRegioes:
+    """Features do GeoJSON de regiões por nível de tolerância, indexadas por `ra`."""
+
+    # limite de rodadas de correção de autointerseções
+    REFINOS = 50
+
+    def __init__(self, geojson, tolerancias=TOLERANCIAS):
+        self.tolerancias = (0,) + tuple(sorted(tolerancias))
+        features = geojson["features"]
+        aneis = {id(c): _anel(c) for f in features for poligono in _poligonos(f["geometry"])
+                 for c in poligono}
+        juncoes = _juncoes(aneis.values())
+
+        # cada anel vira uma lista de (nº do trecho, invertido); o trecho
+        # compartilhado por duas regiões tem um único número
+        self._trechos = []
+        numeros = {}
+        self._regioes = []   # (feature, polígonos -> anéis -> trechos)
+        for f in features:
+            poligonos = []
+            for poligono in _poligonos(f["geometry"]):
+                aneis_poligono = []
+                for coordenadas in poligono:
+                    anel = []
+                    for trecho in _trechos(aneis[id(coordenadas)], juncoes):
+                        chave, invertido = _canonico(trecho)
+                        if chave not in numeros:
+                            numeros[chave] = len(self._trechos)
+                            self._trechos.append(np.array(chave))
+                        anel.append((numeros[chave], invertido))
+                    aneis_poligono.append(anel)
+                poligonos.append(aneis_poligono)
+            self._regioes.append((f, poligonos))
+
+        self.features = {t: self._nivel(t) for t in self.tolerancias}
+
+    @classmethod
+    def carregar(cls, caminho=CAMINHO_PADRAO, tolerancias=TOLERANCIAS):
+        with open(caminho, "r", encoding="utf-8") as f:
+            return cls(json.load(f), tolerancias)
+
+    def _nivel(self, tolerancia):
+        """
+        Features simplificadas com `tolerancia`. Douglas-Peucker pode fazer
+        um contorno cruzar outro trecho da mesma região: a cada rodada, cada
+        segmento que cruza outro ganha de volta o vértice original mais
+        distante dele, e as regiões que usam os trechos alterados são
+        refeitas (a fronteira comum continua igual nas duas).
+        """
+        if tolerancia:
+            mantidos = [_douglas_peucker(t, tolerancia) for t in self._trechos]
+        else:
+            mantidos = [np.ones(len(t), dtype=bool) for t in self._trechos]
+        nivel = {}
+        pendentes = self._regioes
+        for _ in range(self.REFINOS):
+            refinados = set()
+            for regiao in pendentes:
+                feature, segmentos, origem = self._feature(regiao, mantidos, tolerancia)
+                nivel[feature["properties"]["ra"]] = feature
+                if not tolerancia or not origem:
+                    continue
+                for k in _cruzamentos(segmentos):
+                    numero, i, j = origem[k]
+                    if j > i + 1:
+                        mantidos[numero][_mais_distante(self._trechos[numero], i, j)[0]] = True
+                        refinados.add(numero)
+            if not refinados:
+                break
+            pendentes = [(f, poligonos) for f, poligonos in self._regioes
+                         if any(n in refinados for p in poligonos for a in p for n, _ in a)]
+        return nivel
+
+    def _feature(self, regiao, mantidos, tolerancia):
+        """
+        (feature simplificada, segmentos n x 4 dos anéis, origem de cada
+        segmento: nº do trecho e índices das pontas no trecho).
+        """
+        feature, poligonos_trechos = regiao
+        poligonos, segmentos, origem = [], [], []
+        for aneis_trechos in poligonos_trechos:
+            aneis = []
+            for trechos in aneis_trechos:
+                anel, origem_anel = self._anel(trechos, mantidos, tolerancia)
+                if len(anel) >= 4:
+                    aneis.append(anel)
+                    pontos = np.array(anel)
+                    segmentos.append(np.hstack([pontos[:-1], pontos[1:]]))
+                    origem += origem_anel
+                elif not aneis:
+                    break  # o contorno sumiu nesta tolerância: os buracos também
+            if aneis:
+                poligonos.append(aneis)
+        if not poligonos:
+            # região menor que a tolerância: mantém a geometria original
+            return feature, np.empty((0, 4)), []
+        simplificada = {
+            "type": "Feature",
+            "properties": feature["properties"],
+            "geometry": {"type": "MultiPolygon", "coordinates": poligonos},
+        }
+        return simplificada, np.vstack(segmentos), origem
+
+    def _anel(self, trechos, mantidos, tolerancia):
+        """Anel fechado (lista de [x, y]) e a origem (nº do trecho, i, j) de cada segmento."""
+        pontos, origem = [], []
+        for numero, invertido in trechos:
+            indices = np.flatnonzero(mantidos[numero])
+            if invertido:
+                indices = indices[::-1]
+            resultado = self._trechos[numero][indices]
+            if tolerancia:
+                resultado = resultado.round(CASAS)
+            pontos.extend(resultado[1:].tolist() if pontos else resultado.tolist())
+            origem += [(numero, min(i, j), max(i, j)) for i, j in zip(indices, indices[1:])]
+        return pontos, origem
+
+    def nivel(self, tolerancia):
+        """Maior nível pré-calculado que não passa de `tolerancia`."""
+        return max(t for t in self.tolerancias if t <= tolerancia)
+
+    def geojson(self, nomes=None, tolerancia=TOLERANCIA_PADRAO):
+        """FeatureCollection só com as regiões de `nomes` (None = todas)."""
+        features = self.features[self.nivel(tolerancia)]
+        if nomes is None:
+            selecionadas = list(features.values())
+        else:
+            selecionadas = [features[n] for n in nomes if n in features]
+        return {"type": "FeatureCollection", "features": selecionadas}
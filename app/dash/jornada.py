@@ -0,0 +1,152 @@
+"""
+Estado da jornada do aluno (tabela jornada_aluno, models.JornadaAluno, criada
+pelas migrações do app): exame feito, necessidade de óculos, outras
+patologias e óculos entregue, uma linha por id_aluno.
+
+`salvar` recebe só as células editadas e grava cada grupo de alunos com as
+mesmas colunas alteradas num único upsert em lote (INSERT ... ON CONFLICT DO
+UPDATE no PostgreSQL e no SQLite). Só as colunas editadas entram no UPDATE:
+dois coordenadores marcando etapas diferentes do mesmo aluno não se
+sobrescrevem, e o custo de um "Salvar" acompanha o número de mudanças.
+
+A data de cada etapa (<flag>_em) é a da primeira vez em que ela foi marcada;
+desmarcar apaga a data.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import ETAPAS_JORNADA, JornadaAluno
+
+FLAGS = list(ETAPAS_JORNADA)
+
+tabela = JornadaAluno.__table__
+
+
+def versao(conexao):
+    """
+    Marcador barato da tabela (nº de linhas e última gravação): muda a cada
+    "Salvar", inclusive de outro usuário. Usado como chave de cache.
+    """
+    total, ultima = conexao.execute(
+        select(func.count(), func.max(tabela.c.atualizado_em))).one()
+    return total, ultima
+
+
+def carregar(conexao):
+    """DataFrame id_aluno + FLAGS (bool) de todos os alunos com alguma etapa registrada."""
+    df = pd.read_sql(select(tabela.c.id_aluno, *[tabela.c[f] for f in FLAGS]), conexao)
+    df[FLAGS] = df[FLAGS].astype(bool)
+    return df
+
+
+def juntar(alunos, estado):
+    """Anexa as FLAGS de `estado` (saída de `carregar`) a `alunos`, por id_aluno; sem registro = False."""
+    df = alunos.merge(estado, on="id_aluno", how="left")
+    df[FLAGS] = df[FLAGS].fillna(False).astype(bool)
+    return df
+
+
+# --------------------
+# EDIÇÕES PENDENTES E PAGINAÇÃO (aba Detalhes)
+# --------------------
+# As grades mostram uma página por vez; cada célula editada vira uma entrada
+# em `pendentes` ({id_aluno: {flag: valor}}), sobreposta ao estado gravado
+# até o "Salvar".
+
+
+def aplicar_pendentes(df, pendentes):
+    """`df` (uma linha por aluno, com as FLAGS) com as edições ainda não salvas."""
+    if not pendentes:
+        return df
+    df = df.copy()
+    posicoes = pd.Index(df["id_aluno"]).get_indexer(list(pendentes))
+    for posicao, valores in zip(posicoes, pendentes.values()):
+        if posicao < 0:
+            continue
+        for f, valor in valores.items():
+            df.iat[posicao, df.columns.get_loc(f)] = valor
+    return df
+
+
+def efetivas(original, pendentes):
+    """Só as edições de `pendentes` que mudam o estado gravado (`original`, saída de `carregar`)."""
+    atual = original.set_index("id_aluno")
+    resultado = {}
+    for id_aluno, valores in pendentes.items():
+        gravado = atual.loc[id_aluno] if id_aluno in atual.index else None
+        mudou = {f: v for f, v in valores.items()
+                 if gravado is None and v or gravado is not None and bool(gravado[f]) != v}
+        if mudou:
+            resultado[id_aluno] = mudou
+    return resultado
+
+
+def buscar(df, texto):
+    """Linhas cujo nome do aluno contém `texto` (sem diferenciar maiúsculas)."""
+    if not texto:
+        return df
+    return df[df["aluno"].str.contains(texto, case=False, regex=False, na=False)]
+
+
+def paginar(df, ordem, crescente=True, pagina=1, por_pagina=50):
+    """Ordena por `ordem` (desempate por id_aluno) e devolve só a `pagina` pedida."""
+    df = df.sort_values([ordem, "id_aluno"], ascending=[crescente, True],
+                        na_position="last", kind="stable")
+    inicio = (pagina - 1) * por_pagina
+    return df.iloc[inicio:inicio + por_pagina]
+
+
+# --------------------
+# GRAVAÇÃO
+# --------------------
+
+
+def _upsert(conexao, colunas, linhas):
+    dialeto = conexao.dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        insert = (postgresql if dialeto == "postgresql" else sqlite).insert
+        stmt = insert(tabela)
+        set_ = {"atualizado_em": stmt.excluded.atualizado_em}
+        for f in colunas:
+            set_[f] = stmt.excluded[f]
+            # mantém a data da primeira marcação; desmarcar apaga
+            set_[f"{f}_em"] = case((stmt.excluded[f], func.coalesce(tabela.c[f"{f}_em"],
+                                                                    stmt.excluded[f"{f}_em"])),
+                                   else_=None)
+        conexao.execute(stmt.on_conflict_do_update(index_elements=["id_aluno"], set_=set_),
+                        linhas)
+        return
+    for linha in linhas:
+        valores = {"atualizado_em": linha["atualizado_em"]}
+        for f in colunas:
+            valores[f] = linha[f]
+            valores[f"{f}_em"] = (func.coalesce(tabela.c[f"{f}_em"], linha[f"{f}_em"])
+                                  if linha[f] else None)
+        resultado = conexao.execute(
+            update(tabela).where(tabela.c.id_aluno == linha["id_aluno"]).values(valores))
+        if resultado.rowcount == 0:
+            conexao.execute(tabela.insert().values(linha))
+
+
+def salvar(engine, alteracoes):
+    """
+    Grava {id_aluno: {flag: valor}} (ver `efetivas`) numa transação: um
+    upsert em lote por conjunto de colunas alteradas. Retorna quantos alunos
+    foram gravados.
+    """
+    agora = datetime.now()
+    grupos = defaultdict(list)
+    for id_aluno, valores in alteracoes.items():
+        linha = {"id_aluno": id_aluno, "atualizado_em": agora}
+        for f, valor in valores.items():
+            linha[f] = valor
+            linha[f"{f}_em"] = agora if valor else None
+        grupos[tuple(sorted(valores))].append(linha)
+    with engine.begin() as conexao:
+        for colunas, linhas in grupos.items():
+            _upsert(conexao, colunas, linhas)
+    return len(alteracoes)
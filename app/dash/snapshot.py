@@ -0,0 +1,126 @@
+"""
+Snapshot local em Parquet da base do dashboard (ver base_local.BaseExames).
+
+Layout em DASH_SNAPSHOT_DIR (padrão: ./snapshot):
+
+    atual.json                      -> manifesto: pasta vigente, marca, seq
+    snap-<timestamp>/exames/ano=2024/<parte>.parquet
+    snap-<timestamp>/exames/ano=__HIVE_DEFAULT_PARTITION__/...   (sem data)
+    snap-<timestamp>/escolas.parquet
+
+Os exames são particionados por ano (os filtros de data do dashboard só
+tocam as partições do intervalo) e gravados com os mesmos tipos compactos
+da base em memória (base_local.TIPOS): ids int32, textos repetidos (aluno,
+escola, região) em dicionário, medidas float32 e datas como timestamp. A
+leitura usa memory map, então subir o dashboard com um snapshot de milhões
+de linhas não passa pelo banco nem copia o arquivo.
+
+A gravação é atômica: cada snapshot vai para uma pasta nova, e só depois o
+manifesto é trocado (os.replace). Snapshots antigos são apagados em seguida.
+"""
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DIRETORIO_PADRAO = os.environ.get("DASH_SNAPSHOT_DIR", "snapshot")
+MANIFESTO = "atual.json"
+
+# colunas de exames (consultas.COLUNAS_EXAME) -> tipo no Parquet
+TIPOS_EXAMES = {
+    "id_exame": pa.int32(),
+    "id_aluno": pa.int32(),
+    "aluno": pa.dictionary(pa.int32(), pa.string()),
+    "id_escola": pa.int32(),
+    "escola": pa.dictionary(pa.int32(), pa.string()),
+    "regiao": pa.dictionary(pa.int32(), pa.string()),
+    "data_exame": pa.timestamp("us"),
+    "esferico_od": pa.float32(),
+    "cilindrico_od": pa.float32(),
+    "esferico_os": pa.float32(),
+    "cilindrico_os": pa.float32(),
+    "critico": pa.bool_(),
+}
+
+
+def _tabela(df, tipos):
+    colunas = {}
+    for nome, tipo in tipos.items():
+        serie = df[nome]
+        if pa.types.is_dictionary(tipo) and isinstance(serie.dtype, pd.CategoricalDtype):
+            # categorias da base (base_local.TIPOS) viram o dicionário direto
+            colunas[nome] = pa.array(serie).cast(tipo)
+        elif pa.types.is_dictionary(tipo):
+            colunas[nome] = pa.array(serie.astype(object), type=pa.string()).dictionary_encode()
+        else:
+            colunas[nome] = pa.array(serie, type=tipo, from_pandas=True)
+    return pa.table(colunas)
+
+
+def _para_pandas(tabela, dtypes):
+    """Volta para os mesmos dtypes que a base usa ao ler do banco."""
+    df = tabela.to_pandas()
+    for nome, dtype in dtypes.items():
+        if nome in df and df[nome].dtype != dtype:
+            if isinstance(df[nome].dtype, pd.CategoricalDtype):
+                df[nome] = df[nome].astype(object)
+            df[nome] = df[nome].astype(dtype)
+    return df
+
+
+def gravar(exames, escolas, marca, seq, diretorio=DIRETORIO_PADRAO):
+    """Grava um snapshot novo e passa o manifesto para ele."""
+    os.makedirs(diretorio, exist_ok=True)
+    nome = f"snap-{time.time_ns()}"
+    pasta = os.path.join(diretorio, nome)
+
+    tabela = _tabela(exames, TIPOS_EXAMES)
+    anos = pa.array(exames["data_exame"].dt.year.astype("Int32"), type=pa.int32(), from_pandas=True)
+    pq.write_to_dataset(tabela.append_column("ano", anos), os.path.join(pasta, "exames"),
+                        partition_cols=["ano"], compression="zstd")
+    pq.write_table(pa.Table.from_pandas(escolas, preserve_index=False),
+                   os.path.join(pasta, "escolas.parquet"), compression="zstd")
+
+    manifesto = {
+        "pasta": nome,
+        "marca": int(marca),
+        "seq": int(seq),
+        "linhas": len(exames),
+        "dtypes": {c: str(t) for c, t in exames.dtypes.items()},
+        "gravado_em": time.time(),
+    }
+    tmp = os.path.join(diretorio, MANIFESTO + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f)
+    os.replace(tmp, os.path.join(diretorio, MANIFESTO))  # troca atômica
+
+    for antigo in os.listdir(diretorio):
+        if antigo.startswith("snap-") and antigo != nome:
+            shutil.rmtree(os.path.join(diretorio, antigo), ignore_errors=True)
+    return manifesto
+
+
+def carregar(diretorio=DIRETORIO_PADRAO):
+    """
+    Lê o snapshot vigente. Retorna (exames, escolas, marca, seq), ou None se
+    não houver snapshot (ou se ele estiver incompleto).
+    """
+    caminho = os.path.join(diretorio, MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            manifesto = json.load(f)
+        pasta = os.path.join(diretorio, manifesto["pasta"])
+        tabela = pq.read_table(os.path.join(pasta, "exames"), memory_map=True,
+                               columns=list(TIPOS_EXAMES))
+        escolas = pq.read_table(os.path.join(pasta, "escolas.parquet"),
+                                memory_map=True).to_pandas()
+    except (OSError, ValueError, KeyError, pa.ArrowException):
+        return None
+    exames = _para_pandas(tabela, manifesto.get("dtypes", {}))
+    return exames, escolas, manifesto["marca"], manifesto["seq"]
@@ -0,0 +1,106 @@
+"""
+Exportação em streaming (CSV / NDJSON) de exames, alunos e escolas.
+
+As consultas são executadas com cursor no servidor (stream_results +
+yield_per; no psycopg2 isso vira um "named cursor"), e as linhas são
+convertidas e enviadas em blocos por um gerador. A memória usada é constante,
+independente do tamanho da tabela, e os primeiros bytes saem assim que o
+banco devolve o primeiro bloco.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import select
+
+from models import db, Aluno, Exame, Escola
+
+# linhas buscadas do cursor por vez (e por bloco enviado ao cliente)
+LINHAS_POR_BLOCO = 2000
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def consulta_exames():
+    """SELECT de exames já com aluno/escola (para aplicar os filtros das listagens)."""
+    colunas = [c for c in Exame.__table__.columns]
+    return (select(*colunas,
+                   Aluno.nome.label('aluno'),
+                   Escola.id_escola,
+                   Escola.nome.label('escola'),
+                   Escola.regiao_administrativa.label('regiao'))
+            .join_from(Exame, Aluno, Exame.id_aluno == Aluno.id_aluno)
+            .join(Escola, Aluno.id_escola == Escola.id_escola)
+            .order_by(Exame.id_exame))
+
+
+def consulta_alunos():
+    """SELECT de alunos com o nome da escola."""
+    return (select(*Aluno.__table__.columns,
+                   Escola.nome.label('escola'))
+            .join_from(Aluno, Escola, Aluno.id_escola == Escola.id_escola)
+            .order_by(Aluno.id_aluno))
+
+
+def consulta_escolas():
+    """SELECT de escolas."""
+    return select(*Escola.__table__.columns).order_by(Escola.id_escola)
+
+
+def _valor_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+def _blocos_csv(colunas, blocos):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    yield buffer.getvalue()
+    for linhas in blocos:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(linhas)
+        yield buffer.getvalue()
+
+
+def _blocos_ndjson(colunas, blocos):
+    for linhas in blocos:
+        yield ''.join(
+            json.dumps({c: _valor_json(v) for c, v in zip(colunas, linha)},
+                       ensure_ascii=False) + '\n'
+            for linha in linhas
+        )
+
+
+def _gerar(stmt, formato):
+    """Executa `stmt` com cursor no servidor e gera o arquivo em blocos de texto."""
+    with db.engine.connect() as conexao:
+        resultado = conexao.execution_options(
+            stream_results=True, yield_per=LINHAS_POR_BLOCO).execute(stmt)
+        colunas = list(resultado.keys())
+        blocos = resultado.partitions(LINHAS_POR_BLOCO)
+        if formato == 'csv':
+            yield from _blocos_csv(colunas, blocos)
+        else:
+            yield from _blocos_ndjson(colunas, blocos)
+
+
+def resposta_streaming(stmt, formato, nome_arquivo):
+    """Monta a Response Flask que transmite o resultado de `stmt` em `formato`."""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato}. Use csv ou ndjson.")
+    return Response(
+        stream_with_context(_gerar(stmt, formato)),
+        mimetype=FORMATOS[formato],
+        headers={
+            'Content-Disposition': f'attachment; filename={nome_arquivo}.{formato}',
+            # não deixa proxies (nginx) acumularem a resposta inteira
+            'X-Accel-Buffering': 'no',
+        })
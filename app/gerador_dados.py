@@ -0,0 +1,343 @@
+"""
+Gerador de dados sintéticos para o esquema atual (escola / aluno / exame).
+
+Substitui ingestão.py (commit por linha, esquema antigo `exames`) e
+ingestão2.py (tabelas endereco/regiao_administrativa que o app não usa mais).
+
+- Determinístico: a mesma --seed gera exatamente os mesmos dados, qualquer
+  que seja o número de workers (cada bloco tem seu próprio gerador,
+  semeado por (seed, tabela, índice do bloco)).
+- Vetorizado com numpy, um bloco de --lote linhas por vez.
+- Carga com COPY no PostgreSQL, com vários processos por tabela; nos demais
+  bancos usa INSERT multi-linha num único processo. No fim as tabelas-resumo
+  (resumos.py) são reconstruídas e os exames classificados pelas regras de
+  triagem (triagem.py).
+
+Distribuições (aproximadas para triagem escolar):
+  - equivalente esférico: mistura de emetropia/hipermetropia leve (~75%),
+    miopia (~20%) e hipermetropia moderada (~5%), em passos de 0,25 D;
+    o olho esquerdo é correlacionado com o direito
+  - cilindro negativo com cauda exponencial, em ds_* (a coluna de cilindro
+    da triagem, do dashboard e da migração do legado; dc_* repete o valor);
+    eixo concentrado "a favor da regra" (~180°), depois "contra a regra"
+    (~90°) e oblíquo
+  - raio corneano ~ N(7,8; 0,25) mm e DIP ~ N(58; 3,5) mm
+
+Uso:
+    python gerador_dados.py --escolas 300 --alunos 200000 --exames 1000000 --limpar
+    python gerador_dados.py --exames 20000000 --workers 8 --lote 250000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from dados.conexao import URI_PADRAO, criar_engine
+from models import Aluno, Escola, Exame
+from importacao import inserir_multilinha
+import migracoes
+import resumos
+import triagem
+
+# Regiões administrativas do DF com pesos aproximados (população)
+REGIOES = {
+    "Plano Piloto": 22, "Gama": 14, "Taguatinga": 21, "Brazlândia": 6,
+    "Sobradinho": 7, "Planaltina": 19, "Paranoá": 7, "Núcleo Bandeirante": 2,
+    "Ceilândia": 35, "Guará": 14, "Cruzeiro": 3, "Samambaia": 25,
+    "Santa Maria": 13, "São Sebastião": 12, "Recanto das Emas": 14,
+    "Lago Sul": 3, "Riacho Fundo": 4, "Lago Norte": 4, "Candangolândia": 2,
+    "Águas Claras": 12, "Riacho Fundo II": 5, "Sudoeste/Octogonal": 5,
+    "Varjão": 1, "Park Way": 2, "SCIA": 3, "Sobradinho II": 8,
+    "Jardim Botânico": 3, "Itapoã": 6, "SIA": 1, "Vicente Pires": 7,
+    "Fercal": 1, "Sol Nascente/Pôr do Sol": 9, "Arniqueira": 5,
+    "Arapoanga": 5, "Água Quente": 1,
+}
+TIPOS_ESCOLA = ["Escola Classe", "Centro de Ensino Fundamental",
+                "Centro Educacional", "Centro de Ensino Médio", "Jardim de Infância"]
+NOMES = ["Ana", "Bruno", "Carla", "Daniel", "Eduarda", "Felipe", "Gabriela", "Heitor",
+         "Isabela", "João", "Larissa", "Miguel", "Nicole", "Otávio", "Pedro", "Rafaela",
+         "Samuel", "Sofia", "Thiago", "Valentina", "Arthur", "Beatriz", "Davi", "Helena",
+         "Lucas", "Laura", "Matheus", "Manuela", "Gustavo", "Alice"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves",
+              "Pereira", "Lima", "Gomes", "Costa", "Ribeiro", "Martins", "Carvalho",
+              "Almeida", "Lopes", "Soares", "Fernandes", "Vieira", "Barbosa"]
+
+TABELAS = ('escola', 'aluno', 'exame')
+TABELAS_MODELO = {'escola': Escola.__table__, 'aluno': Aluno.__table__, 'exame': Exame.__table__}
+
+
+# --------------------
+# GERAÇÃO (numpy, por bloco)
+# --------------------
+
+
+def _rng(seed, tabela, bloco):
+    return np.random.default_rng([seed, TABELAS.index(tabela), bloco])
+
+
+def _passo(valores, passo=0.25):
+    return np.round(valores / passo) * passo
+
+
+def gerar_escolas(rng, ini, n):
+    ids = np.arange(ini, ini + n)
+    nomes_ra = np.array(list(REGIOES))
+    pesos = np.array(list(REGIOES.values()), dtype=float)
+    regioes = rng.choice(nomes_ra, size=n, p=pesos / pesos.sum())
+    tipos = rng.choice(TIPOS_ESCOLA, size=n)
+    return pd.DataFrame({
+        'id_escola': ids,
+        'nome': [f"{t} {i} de {r}" for t, i, r in zip(tipos, ids, regioes)],
+        'logradouro': [f"Quadra {q}" for q in rng.integers(1, 60, n)],
+        'numero': rng.integers(1, 999, n).astype(str),
+        'complemento': None,
+        'bairro': regioes,
+        'cidade': 'Brasília',
+        'estado': 'DF',
+        'cep': [f"7{c:04d}-000" for c in rng.integers(0, 9999, n)],
+        'latitude': np.round(rng.normal(-15.79, 0.12, n), 6),
+        'longitude': np.round(rng.normal(-47.93, 0.15, n), 6),
+        'regiao_administrativa': regioes,
+    })
+
+
+def gerar_alunos(rng, ini, n, escolas):
+    ids_escola = escolas['id_escola'].to_numpy()
+    idx = rng.integers(0, len(ids_escola), n)
+    nascimento = (np.datetime64('2007-01-01')
+                  + rng.integers(0, (date(2019, 1, 1) - date(2007, 1, 1)).days, n)
+                  .astype('timedelta64[D]'))
+    return pd.DataFrame({
+        'id_aluno': np.arange(ini, ini + n),
+        'nome': (pd.Series(rng.choice(NOMES, n)) + ' '
+                 + pd.Series(rng.choice(SOBRENOMES, n)) + ' '
+                 + pd.Series(rng.choice(SOBRENOMES, n))),
+        'data_nascimento': pd.Series(nascimento).dt.date,
+        'sexo': rng.choice(['Masculino', 'Feminino'], n),
+        'id_escola': ids_escola[idx],
+        'regiao_administrativa': escolas['regiao_administrativa'].to_numpy()[idx],
+    })
+
+
+def _equivalente_esferico(rng, n):
+    grupo = rng.choice(3, size=n, p=[0.75, 0.20, 0.05])
+    media = np.array([0.5, -2.0, 3.0])[grupo]
+    desvio = np.array([0.75, 1.5, 1.0])[grupo]
+    return rng.normal(media, desvio)
+
+
+def _eixo(rng, n):
+    tipo = rng.choice(3, size=n, p=[0.60, 0.25, 0.15])
+    centro = np.where(tipo == 0, 180, 90)
+    eixo = np.where(tipo == 2, rng.integers(1, 181, n),
+                    np.round(rng.normal(centro, 12)).astype(int))
+    return ((eixo - 1) % 180 + 1).astype(int)
+
+
+def gerar_exames(rng, ini, n, id_aluno_min, id_aluno_max, inicio, fim):
+    se_od = _equivalente_esferico(rng, n)
+    se_os = se_od + rng.normal(0, 0.35, n)
+    cil_od = 0.0 - _passo(rng.exponential(0.5, n))
+    cil_os = 0.0 - _passo(np.clip(-cil_od + rng.normal(0, 0.25, n), 0, None))
+    steeper_od = rng.uniform(0, 180, n)
+    steeper_os = (steeper_od + rng.normal(0, 10, n)) % 180
+
+    segundos = int((fim - inicio).total_seconds())
+    data_hora = (np.datetime64(inicio)
+                 + rng.integers(0, max(segundos, 1), n).astype('timedelta64[s]'))
+
+    df = pd.DataFrame({
+        'id_exame': np.arange(ini, ini + n),
+        'id_aluno': rng.integers(id_aluno_min, id_aluno_max + 1, n),
+        'data_hora_escaneamento': data_hora,
+        'raio_corneano_od_mm': np.round(rng.normal(7.8, 0.25, n), 2),
+        'eixo_querato_steeper_od': np.round(steeper_od, 1),
+        'eixo_querato_flatter_od': np.round((steeper_od + 90) % 180, 1),
+        'se_direito': _passo(se_od),
+        'ds_direito': cil_od,
+        'dc_direito': cil_od,
+        'axis_direito': _eixo(rng, n),
+        'distancia_interpupilar_mm': np.round(rng.normal(58, 3.5, n), 1),
+        'input5': np.nan,
+        'se_esquerdo': _passo(se_os),
+        'ds_esquerdo': cil_os,
+        'dc_esquerdo': cil_os,
+        'axis_esquerdo': _eixo(rng, n),
+        'raio_corneano_os_mm': np.round(rng.normal(7.8, 0.25, n), 2),
+        'eixo_querato_steeper_os': np.round(steeper_os, 1),
+        'eixo_querato_flatter_os': np.round((steeper_os + 90) % 180, 1),
+    })
+    return df
+
+
+# --------------------
+# CARGA
+# --------------------
+
+_engine = None
+
+
+def _iniciar_worker(uri):
+    global _engine
+    _engine = criar_engine(uri)
+
+
+def _copiar(df, tabela):
+    """Grava `df` em `tabela` numa transação própria (COPY ou INSERT multi-linha)."""
+    if _engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='',
+                  date_format='%Y-%m-%d %H:%M:%S')
+        buffer.seek(0)
+        conexao = _engine.raw_connection()
+        try:
+            with conexao.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {tabela} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+                    buffer)
+            conexao.commit()
+        finally:
+            conexao.close()
+    else:
+        conexao = _engine.raw_connection()
+        try:
+            inserir_multilinha(conexao, _engine.dialect, TABELAS_MODELO[tabela], df)
+            conexao.commit()
+        finally:
+            conexao.close()
+
+
+def _tarefa(args):
+    """Gera e grava um bloco (roda nos workers)."""
+    tabela, bloco, ini, n, seed, contexto = args
+    rng = _rng(seed, tabela, bloco)
+    if tabela == 'aluno':
+        df = gerar_alunos(rng, ini, n, contexto['escolas'])
+    else:
+        df = gerar_exames(rng, ini, n, contexto['id_aluno_min'], contexto['id_aluno_max'],
+                          contexto['inicio'], contexto['fim'])
+    _copiar(df, tabela)
+    return n
+
+
+def _blocos(tabela, ini, total, lote, seed, contexto):
+    return [(tabela, b, ini + off, min(lote, total - off), seed, contexto)
+            for b, off in enumerate(range(0, total, lote))]
+
+
+def _proximo_id(conexao, tabela, coluna):
+    return (conexao.execute(text(f"SELECT MAX({coluna}) FROM {tabela}")).scalar() or 0) + 1
+
+
+def _ajustar_sequencias(engine):
+    """Como os ids são explícitos, alinha as sequences do PostgreSQL ao MAX(id)."""
+    if engine.dialect.name != 'postgresql':
+        return
+    with engine.begin() as conexao:
+        for tabela, coluna in (('escola', 'id_escola'), ('aluno', 'id_aluno'),
+                               ('exame', 'id_exame')):
+            conexao.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), "
+                f"COALESCE((SELECT MAX({coluna}) FROM {tabela}), 1))"))
+
+
+def gerar(uri, n_escolas, n_alunos, n_exames, seed=42, workers=1, lote=200000,
+          limpar=False, inicio=datetime(2024, 2, 1), fim=datetime(2024, 12, 15)):
+    """Gera e carrega os dados; retorna o tempo gasto por tabela (segundos)."""
+    engine = criar_engine(uri)
+    if engine.dialect.name != 'postgresql':
+        workers = 1  # SQLite/MySQL: escrita concorrente não compensa
+
+    # mesmo esquema (tabelas + índices) que o app usa em produção
+    migracoes.atualizar(engine, log=lambda msg: None)
+
+    with engine.begin() as conexao:
+        if limpar:
+            if engine.dialect.name == 'postgresql':
+                conexao.execute(text("TRUNCATE exame, aluno, escola RESTART IDENTITY CASCADE"))
+            else:
+                for tabela in ('exame', 'aluno', 'escola'):
+                    conexao.execute(text(f"DELETE FROM {tabela}"))
+        id_escola = _proximo_id(conexao, 'escola', 'id_escola')
+        id_aluno = _proximo_id(conexao, 'aluno', 'id_aluno')
+        id_exame = _proximo_id(conexao, 'exame', 'id_exame')
+
+    tempos = {}
+    _iniciar_worker(uri)
+
+    # escolas: poucas linhas, um único bloco no processo principal
+    t0 = time.time()
+    escolas = gerar_escolas(_rng(seed, 'escola', 0), id_escola, n_escolas)
+    if n_escolas:
+        _copiar(escolas, 'escola')
+    tempos['escola'] = time.time() - t0
+
+    contexto_alunos = {'escolas': escolas[['id_escola', 'regiao_administrativa']]}
+    contexto_exames = {'id_aluno_min': id_aluno, 'id_aluno_max': id_aluno + n_alunos - 1,
+                       'inicio': inicio, 'fim': fim}
+    if n_exames and not n_alunos:
+        raise SystemExit("Para gerar exames é preciso gerar alunos (--alunos > 0).")
+
+    pool = (ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker,
+                                initargs=(uri,)) if workers > 1 else None)
+    try:
+        for tabela, ini, total, contexto in (('aluno', id_aluno, n_alunos, contexto_alunos),
+                                             ('exame', id_exame, n_exames, contexto_exames)):
+            t0 = time.time()
+            tarefas = _blocos(tabela, ini, total, lote, seed, contexto)
+            feitos = 0
+            resultados = pool.map(_tarefa, tarefas) if pool else map(_tarefa, tarefas)
+            for n in resultados:
+                feitos += n
+                print(f"{tabela}: {feitos}/{total} "
+                      f"({feitos / max(time.time() - t0, 1e-9):,.0f} linhas/s)")
+            tempos[tabela] = time.time() - t0
+    finally:
+        if pool:
+            pool.shutdown()
+
+    _ajustar_sequencias(engine)
+
+    # a carga direta não passa pelos ganchos do ORM: recalcula os resumos
+    # e a classificação de triagem
+    t0 = time.time()
+    with engine.begin() as conexao:
+        resumos.reconstruir(conexao)
+    tempos['resumos'] = time.time() - t0
+    t0 = time.time()
+    with engine.begin() as conexao:
+        triagem.reclassificar(conexao, registrar=False)
+    tempos['triagem'] = time.time() - t0
+    return tempos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos (escola/aluno/exame).")
+    parser.add_argument('--db', default=os.environ.get('DATABASE_URL', URI_PADRAO),
+                        help="URI do banco (padrão: $DATABASE_URL ou o do app)")
+    parser.add_argument('--escolas', type=int, default=300)
+    parser.add_argument('--alunos', type=int, default=100000)
+    parser.add_argument('--exames', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="processos por tabela (só PostgreSQL)")
+    parser.add_argument('--lote', type=int, default=200000, help="linhas por bloco/COPY")
+    parser.add_argument('--limpar', action='store_true',
+                        help="apaga exame/aluno/escola antes de gerar")
+    args = parser.parse_args(argv)
+
+    tempos = gerar(args.db, args.escolas, args.alunos, args.exames, seed=args.seed,
+                   workers=args.workers, lote=args.lote, limpar=args.limpar)
+    for tabela, seg in tempos.items():
+        print(f"{tabela}: {seg:.1f}s")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
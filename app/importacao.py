@@ -0,0 +1,258 @@
+"""
+Importação em lote de exames a partir de planilhas (CSV/XLSX).
+
+O arquivo deve ter uma linha por exame, com cabeçalho usando os mesmos nomes
+das colunas da tabela `exame` (ex.: id_aluno, data_hora_escaneamento,
+se_direito, ...). Colunas ausentes ficam nulas; colunas desconhecidas são
+ignoradas.
+
+Fluxo:
+  1) ler_planilha  -> DataFrame com tudo como texto
+  2) validar_lote  -> converte/valida o lote inteiro de forma vetorizada e
+                      separa as linhas rejeitadas (com o motivo)
+  3) carregar_lote -> classifica os exames pelas regras de triagem
+                      (triagem.py), grava as linhas válidas numa única
+                      transação, usando COPY no PostgreSQL e INSERT
+                      multi-linha nos demais bancos, e atualiza as
+                      tabelas-resumo (resumos.py)
+"""
+import csv
+import io
+import os
+
+import pandas as pd
+
+from models import db, Aluno, Exame
+import resumos
+import triagem
+
+# colunas que o arquivo pode trazer (a PK é gerada pelo banco e a
+# classificação de triagem é calculada na carga)
+COLUNAS_EXAME = [c.name for c in Exame.__table__.columns
+                 if c.name not in ('id_exame', 'critico')]
+
+# limite de parâmetros por statement no fallback (SQLite antigo aceita 999)
+LIMITE_PARAMETROS = 999
+
+# tamanho dos lotes de ids na verificação de alunos existentes
+LOTE_IDS = 10000
+
+# faixa de db.Integer (int4 no PostgreSQL): fora dela o COPY derruba o lote inteiro
+INTEIRO_MIN, INTEIRO_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+# separadores aceitos em CSV (detectados pelo cabeçalho)
+SEPARADORES = ',;\t|'
+
+
+def _separador(arquivo):
+    """Separador do CSV pela 1ª linha (o cabeçalho); volta o arquivo ao início."""
+    linha = arquivo.readline()
+    arquivo.seek(0)
+    if isinstance(linha, bytes):
+        linha = linha.decode('utf-8-sig', errors='ignore')
+    try:
+        return csv.Sniffer().sniff(linha, delimiters=SEPARADORES).delimiter
+    except csv.Error:
+        return ','
+
+
+def ler_planilha(arquivo, nome_arquivo):
+    """Lê CSV ou XLSX mantendo todas as células como texto (validação é feita depois)."""
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao == '.xlsx':
+        df = pd.read_excel(arquivo, dtype=str)
+    elif extensao in ('.csv', '.txt'):
+        # separador detectado uma vez; a leitura usa o parser em C
+        df = pd.read_csv(arquivo, dtype=str, sep=_separador(arquivo))
+    else:
+        raise ValueError("Formato não suportado. Envie um arquivo .csv ou .xlsx.")
+
+    df.columns = [str(c).strip() for c in df.columns]
+    if 'id_aluno' not in df.columns:
+        raise ValueError("A planilha precisa ter a coluna 'id_aluno'.")
+    return df
+
+
+def _tipo_coluna(coluna):
+    """Classifica a coluna do modelo em 'int', 'float' ou 'datetime'."""
+    if isinstance(coluna.type, db.Integer):
+        return 'int'
+    if isinstance(coluna.type, db.Float):
+        return 'float'
+    if isinstance(coluna.type, db.DateTime):
+        return 'datetime'
+    raise TypeError(f"Tipo de coluna não suportado na importação: {coluna.name}")
+
+
+def _alunos_existentes(ids):
+    """Retorna o conjunto de ids de `ids` que existem na tabela aluno."""
+    ids = list(ids)
+    existentes = set()
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = ids[i:i + LOTE_IDS]
+        existentes.update(
+            r[0] for r in db.session.query(Aluno.id_aluno).filter(Aluno.id_aluno.in_(lote))
+        )
+    return existentes
+
+
+def validar_lote(df):
+    """
+    Converte o lote para os tipos das colunas de `Exame`.
+
+    Retorna (validos, rejeitados):
+      - validos: DataFrame tipado só com as linhas aceitas, nas colunas COLUNAS_EXAME
+      - rejeitados: lista de dicts {'linha', 'motivo'}; 'linha' é a linha do
+        arquivo (o cabeçalho é a linha 1)
+    """
+    colunas = {c.name: c for c in Exame.__table__.columns if c.name in COLUNAS_EXAME}
+    motivos = pd.Series('', index=df.index, dtype=object)
+    validos = pd.DataFrame(index=df.index)
+
+    for nome, coluna in colunas.items():
+        if nome not in df.columns:
+            validos[nome] = pd.Series(pd.NA, index=df.index)
+            continue
+
+        bruto = df[nome].str.strip()
+        bruto = bruto.where(bruto != '')
+        preenchido = bruto.notna()
+        tipo = _tipo_coluna(coluna)
+
+        if tipo == 'datetime':
+            convertido = pd.to_datetime(bruto, errors='coerce', format='ISO8601')
+            invalido = preenchido & convertido.isna()
+        else:
+            # aceita vírgula como separador decimal
+            convertido = pd.to_numeric(bruto.str.replace(',', '.', regex=False), errors='coerce')
+            invalido = preenchido & convertido.isna()
+            if tipo == 'int':
+                nao_inteiro = convertido.notna() & (
+                    (convertido != convertido.round())
+                    | (convertido < INTEIRO_MIN) | (convertido > INTEIRO_MAX))
+                invalido |= nao_inteiro
+                convertido = convertido.where(~nao_inteiro).astype('Int64')
+
+        if not coluna.nullable:
+            invalido |= ~preenchido
+        motivos[invalido] += f"{nome} inválido; "
+        validos[nome] = convertido
+
+    # alunos precisam existir (uma consulta por lote de ids, não por linha)
+    ids = validos['id_aluno'].dropna().unique()
+    existentes = _alunos_existentes(int(i) for i in ids)
+    sem_aluno = validos['id_aluno'].notna() & ~validos['id_aluno'].isin(existentes)
+    motivos[sem_aluno] += "aluno não encontrado; "
+
+    rejeitado = motivos != ''
+    rejeitados = [
+        {'linha': int(i) + 2, 'motivo': m.rstrip('; ')}
+        for i, m in motivos[rejeitado].items()
+    ]
+    return validos.loc[~rejeitado, COLUNAS_EXAME], rejeitados
+
+
+def _copy_postgres(df):
+    """Carrega via COPY ... FROM STDIN na conexão da sessão (mesma transação)."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='',
+              date_format='%Y-%m-%d %H:%M:%S', quoting=csv.QUOTE_MINIMAL)
+    buffer.seek(0)
+
+    conexao = db.session.connection().connection
+    cursor = conexao.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY exame ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            buffer)
+    finally:
+        cursor.close()
+
+
+def _executemany(cursor, dialeto, tabela, colunas, linhas):
+    """`tabela.insert()` compilado para o dialeto e executado linha a linha (executemany)."""
+    compilado = tabela.insert().compile(dialect=dialeto, column_keys=colunas)
+    registros = [dict(zip(colunas, linha)) for linha in linhas]
+    if compilado.positional:
+        registros = [tuple(r[nome] for nome in compilado.positiontup) for r in registros]
+    cursor.executemany(str(compilado), registros)
+
+
+def inserir_multilinha(conexao, dialeto, tabela, df):
+    """
+    Fallback do COPY (SQLite, MySQL): INSERT ... VALUES (...), (...), ... em
+    blocos, executado direto no cursor DBAPI de `conexao`. O texto do
+    statement é montado uma vez por tamanho de bloco, sem compilar SQL a cada
+    bloco. `tabela` é a Table do SQLAlchemy (usada para converter os valores).
+    Drivers com outro paramstyle (named, numeric) recebem o `tabela.insert()`
+    como executemany.
+    """
+    # converte coluna a coluna para os valores que o driver espera
+    valores_por_coluna = []
+    for nome in df.columns:
+        valores = df[nome].astype(object).where(df[nome].notna(), None).tolist()
+        if pd.api.types.is_datetime64_any_dtype(df[nome]):
+            valores = [v.to_pydatetime() if v is not None else None for v in valores]
+        processar = tabela.c[nome].type.dialect_impl(dialeto).bind_processor(dialeto)
+        if processar:
+            valores = [processar(v) if v is not None else None for v in valores]
+        valores_por_coluna.append(valores)
+    linhas = list(zip(*valores_por_coluna))
+
+    cursor = conexao.cursor()
+    try:
+        marcador = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}.get(dialeto.paramstyle)
+        if marcador is None:
+            _executemany(cursor, dialeto, tabela, list(df.columns), linhas)
+            return
+
+        grupo = '(' + ', '.join([marcador] * len(df.columns)) + ')'
+        prefixo = f"INSERT INTO {tabela.name} ({', '.join(df.columns)}) VALUES "
+        por_statement = max(LIMITE_PARAMETROS // len(df.columns), 1)
+        sql_cheio = prefixo + ', '.join([grupo] * por_statement)
+        for i in range(0, len(linhas), por_statement):
+            bloco = linhas[i:i + por_statement]
+            sql = sql_cheio if len(bloco) == por_statement else prefixo + ', '.join([grupo] * len(bloco))
+            cursor.execute(sql, [v for linha in bloco for v in linha])
+    finally:
+        cursor.close()
+
+
+def carregar_lote(validos):
+    """
+    Grava as linhas válidas numa única transação. Em caso de erro nada é
+    gravado (rollback) e a exceção é propagada.
+    """
+    if validos.empty:
+        return 0
+    try:
+        validos = validos.assign(critico=triagem.classificar_lote(db.session.connection(), validos))
+        if db.engine.dialect.name == 'postgresql':
+            _copy_postgres(validos)
+        else:
+            inserir_multilinha(db.session.connection().connection, db.engine.dialect,
+                               Exame.__table__, validos)
+        resumos.exames_em_lote(db.session.connection(), validos)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(validos)
+
+
+def importar_exames(arquivo, nome_arquivo, tudo_ou_nada=False):
+    """
+    Lê, valida e carrega uma planilha de exames.
+
+    Retorna dict com 'total', 'importados' e 'rejeitados' (lista por linha).
+    Com tudo_ou_nada=True, qualquer rejeição cancela a carga inteira.
+    """
+    df = ler_planilha(arquivo, nome_arquivo)
+    validos, rejeitados = validar_lote(df)
+
+    importados = 0
+    if not (tudo_ou_nada and rejeitados):
+        importados = carregar_lote(validos)
+
+    return {'total': len(df), 'importados': importados, 'rejeitados': rejeitados}
@@ -0,0 +1,195 @@
+"""
+Instrumentação por requisição e endpoint /metrics (formato texto do Prometheus).
+
+Para cada requisição são registrados:
+  - latência total, tempo gasto no banco e tempo de renderização de templates
+  - número de statements SQL (ótimo para pegar N+1: a rota que antes fazia
+    2 consultas e passa a fazer 200 aparece no histograma)
+  - tamanho da resposta
+
+Requisições acima de METRICAS_LIMIAR_LENTO_MS vão para o logger
+"metricas.lentas" junto com os SQL executados.
+
+As métricas ficam em memória, por processo (com vários workers do gunicorn,
+cada um expõe as suas). Em respostas em streaming (/exportar), o SQL que roda
+durante a transmissão do corpo não entra na contagem da requisição.
+"""
+import logging
+import threading
+import time
+
+from flask import (Response, before_render_template, g, has_request_context, request,
+                   template_rendered)
+from sqlalchemy import event
+
+log_lentas = logging.getLogger('metricas.lentas')
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_SQL = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+BUCKETS_BYTES = (1024, 10240, 102400, 524288, 1048576, 5242880, 20971520)
+
+# máximo de statements guardados por requisição para o log de lentas
+MAX_SQL_NO_LOG = 200
+
+
+class Histograma:
+    """Histograma cumulativo por conjunto de labels (como o do Prometheus)."""
+
+    def __init__(self, nome, ajuda, buckets):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = buckets
+        self.series = {}  # labels -> [contagens por bucket..., soma, total]
+
+    def observar(self, labels, valor):
+        serie = self.series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[i] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for labels, serie in sorted(self.series.items()):
+            base = _labels(labels)
+            for limite, contagem in zip(self.buckets, serie):
+                linhas.append(f'{self.nome}_bucket{{{base},le="{limite}"}} {contagem}')
+            linhas.append(f'{self.nome}_bucket{{{base},le="+Inf"}} {serie[-1]}')
+            linhas.append(f'{self.nome}_sum{{{base}}} {serie[-2]}')
+            linhas.append(f'{self.nome}_count{{{base}}} {serie[-1]}')
+        return linhas
+
+
+class Contador:
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.series = {}
+
+    def incrementar(self, labels, valor=1):
+        self.series[labels] = self.series.get(labels, 0) + valor
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for labels, valor in sorted(self.series.items()):
+            linhas.append(f"{self.nome}{{{_labels(labels)}}} {valor}")
+        return linhas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{k}="{_escapar(v)}"' for k, v in labels)
+
+
+_lock = threading.Lock()
+duracao = Histograma('http_request_duration_seconds', 'Latência total da requisição.',
+                     BUCKETS_SEGUNDOS)
+tempo_db = Histograma('http_request_db_seconds', 'Tempo gasto em SQL na requisição.',
+                      BUCKETS_SEGUNDOS)
+tempo_template = Histograma('http_request_template_seconds',
+                            'Tempo de renderização de templates na requisição.',
+                            BUCKETS_SEGUNDOS)
+statements = Histograma('http_request_sql_statements',
+                        'Statements SQL executados por requisição.', BUCKETS_SQL)
+tamanho = Histograma('http_response_size_bytes', 'Tamanho do corpo da resposta.',
+                     BUCKETS_BYTES)
+requisicoes = Contador('http_requests_total', 'Requisições atendidas.')
+lentas = Contador('http_slow_requests_total', 'Requisições acima do limiar de lentidão.')
+
+METRICAS = (duracao, tempo_db, tempo_template, statements, tamanho, requisicoes, lentas)
+
+
+# --------------------
+# GANCHOS
+# --------------------
+
+
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metricas' in g:
+        g.metricas['sql_inicio'] = time.perf_counter()
+
+
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'metricas' in g):
+        return
+    m = g.metricas
+    inicio = m.pop('sql_inicio', None)
+    if inicio is None:
+        return
+    gasto = time.perf_counter() - inicio
+    m['sql_n'] += 1
+    m['sql_segundos'] += gasto
+    if len(m['sql']) < MAX_SQL_NO_LOG:
+        m['sql'].append((gasto, statement))
+
+
+def _antes_template(sender, template, context, **extra):
+    if 'metricas' in g:
+        g.metricas['template_inicio'] = time.perf_counter()
+
+
+def _depois_template(sender, template, context, **extra):
+    if 'metricas' in g and 'template_inicio' in g.metricas:
+        g.metricas['template_segundos'] += time.perf_counter() - g.metricas.pop('template_inicio')
+
+
+def _inicio_requisicao():
+    g.metricas = {'inicio': time.perf_counter(), 'sql_n': 0, 'sql_segundos': 0.0,
+                  'sql': [], 'template_segundos': 0.0}
+
+
+def _fim_requisicao(app):
+    def registrar(response):
+        m = g.pop('metricas', None)
+        if m is None or request.endpoint in ('static', 'metrics'):
+            return response
+
+        total = time.perf_counter() - m['inicio']
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        labels = (('metodo', request.method), ('rota', rota))
+        corpo = None if response.is_streamed else response.calculate_content_length()
+
+        with _lock:
+            duracao.observar(labels, total)
+            tempo_db.observar(labels, m['sql_segundos'])
+            tempo_template.observar(labels, m['template_segundos'])
+            statements.observar(labels, m['sql_n'])
+            if corpo is not None:
+                tamanho.observar(labels, corpo)
+            requisicoes.incrementar(labels + (('status', response.status_code),))
+
+        limiar = app.config.get('METRICAS_LIMIAR_LENTO_MS', 500) / 1000
+        if total >= limiar:
+            with _lock:
+                lentas.incrementar(labels)
+            sqls = '\n'.join(f"  [{s * 1000:8.1f} ms] {' '.join(sql.split())}"
+                             for s, sql in sorted(m['sql'], reverse=True))
+            log_lentas.warning(
+                "%s %s levou %.0f ms (sql: %d statements / %.0f ms; templates: %.0f ms)\n%s",
+                request.method, request.full_path, total * 1000, m['sql_n'],
+                m['sql_segundos'] * 1000, m['template_segundos'] * 1000, sqls)
+        return response
+    return registrar
+
+
+def metrics():
+    """Exposição das métricas no formato texto do Prometheus."""
+    with _lock:
+        linhas = [linha for metrica in METRICAS for linha in metrica.exportar()]
+    return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_metricas(app, db):
+    """Registra os ganchos de instrumentação e a rota /metrics no app Flask."""
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _antes_sql)
+        event.listen(db.engine, 'after_cursor_execute', _depois_sql)
+    before_render_template.connect(_antes_template, app)
+    template_rendered.connect(_depois_template, app)
+    app.before_request(_inicio_requisicao)
+    app.after_request(_fim_requisicao(app))
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,306 @@
+"""
+Migração dos CSVs no formato antigo (tabela plana `exames`, ver ingestão.py e
+exames_202406121122.csv) para o esquema atual (escola / aluno / exame).
+
+Formato antigo: escola como texto livre, nome e sobrenome separados, medidas
+gravadas como texto e eixos no formato "@18º".
+
+O arquivo é lido em blocos (streaming); cada bloco é normalizado com operações
+vetorizadas do pandas num pool de processos, e o processo principal resolve
+(ou cria) escolas/alunos e grava os exames em lote — COPY no PostgreSQL, via
+importacao.carregar_lote. O progresso (linhas processadas) fica na tabela
+migracao_legado_checkpoint e é gravado na mesma transação do bloco: uma
+execução interrompida continua de onde parou, sem repetir nem perder exames.
+
+Uso:
+    python migracao_legado.py exames_202406121122.csv
+    python migracao_legado.py arquivo.csv --db sqlite:///dev.db --bloco 100000 --workers 4
+
+Escolas que não existem são criadas com endereço "Não informado" e a região
+de --regiao-padrao; revise-as depois em /escolas.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from flask import Flask
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select, update
+
+from dados.conexao import URI_PADRAO
+from models import db, Aluno, Escola
+from importacao import COLUNAS_EXAME, carregar_lote
+import resumos
+
+# coluna antiga -> coluna de `exame`
+MAPA_MEDIDAS = {
+    'OD1': 'raio_corneano_od_mm',
+    'OD2': 'eixo_querato_steeper_od',
+    'OD3': 'eixo_querato_flatter_od',
+    'ODSE': 'se_direito',
+    'ODOS': 'ds_direito',
+    'ODDC': 'dc_direito',
+    'C1': 'distancia_interpupilar_mm',
+    'C2': 'input5',
+    'OESE': 'se_esquerdo',
+    'OEOS': 'ds_esquerdo',
+    'OEDC': 'dc_esquerdo',
+    'OE1': 'raio_corneano_os_mm',
+    'OE2': 'eixo_querato_steeper_os',
+    'OE3': 'eixo_querato_flatter_os',
+}
+MAPA_EIXOS = {
+    'ODAXIS': 'axis_direito',
+    'OEAXIS': 'axis_esquerdo',
+}
+
+# valores usados ao criar escolas que só existem pelo nome no arquivo antigo
+ENDERECO_NAO_INFORMADO = {
+    'logradouro': 'Não informado',
+    'numero': 'S/N',
+    'bairro': 'Não informado',
+    'cidade': 'Brasília',
+    'estado': 'DF',
+    'cep': '00000-000',
+}
+
+CHAVE_ALUNO = ['nome', 'data_nascimento', 'sexo', 'id_escola']
+
+# progresso por arquivo migrado (tabela da ferramenta, fora das migrações do app)
+_meta = MetaData()
+checkpoint_legado = Table(
+    'migracao_legado_checkpoint', _meta,
+    Column('arquivo', String(500), primary_key=True),
+    Column('linhas_processadas', Integer, nullable=False),
+    Column('atualizado_em', DateTime, nullable=False),
+)
+
+
+# --------------------
+# NORMALIZAÇÃO (roda nos workers, sem acesso ao banco)
+# --------------------
+
+
+def _texto(serie):
+    return serie.str.strip().str.replace(r'\s+', ' ', regex=True)
+
+
+def normalizar_bloco(args):
+    """
+    Converte um bloco cru (tudo texto) para colunas tipadas.
+
+    Recebe (bloco, primeira_linha) e devolve (normalizado, rejeitados), onde
+    rejeitados é uma lista de números de linha do arquivo sem os campos
+    mínimos (escola, nome, nascimento, sexo).
+    """
+    bloco, primeira_linha = args
+    out = pd.DataFrame(index=bloco.index)
+    out['linha'] = pd.RangeIndex(primeira_linha, primeira_linha + len(bloco)).to_numpy()
+
+    out['escola'] = _texto(bloco['escola'])
+    out['nome'] = _texto(bloco['nome'].fillna('') + ' ' + bloco['sobrenome'].fillna(''))
+    out['sexo'] = _texto(bloco['sexo']).str.slice(0, 10)
+    out['data_nascimento'] = pd.to_datetime(bloco['nascimento'], errors='coerce',
+                                            format='ISO8601').dt.date
+
+    out['data_hora_escaneamento'] = pd.to_datetime(bloco['data_hora'], errors='coerce',
+                                                   format='ISO8601')
+    for antiga, nova in MAPA_MEDIDAS.items():
+        valores = bloco[antiga].str.strip().str.replace(',', '.', regex=False)
+        out[nova] = pd.to_numeric(valores, errors='coerce')
+    for antiga, nova in MAPA_EIXOS.items():
+        # "@18º" -> 18
+        numeros = bloco[antiga].str.extract(r'(-?\d+)', expand=False)
+        out[nova] = pd.to_numeric(numeros, errors='coerce').astype('Int64')
+
+    obrigatorios = out[['escola', 'nome', 'sexo', 'data_nascimento']]
+    invalido = obrigatorios.isna().any(axis=1) | (out['nome'] == '') | (out['escola'] == '')
+    return out[~invalido], out.loc[invalido, 'linha'].tolist()
+
+
+def _ler_blocos(caminho, tamanho, pular):
+    """Lê o CSV em blocos de texto, pulando as `pular` linhas já migradas."""
+    leitor = pd.read_csv(caminho, dtype=str, chunksize=tamanho,
+                         skiprows=range(1, pular + 1) if pular else None)
+    linha = pular + 2  # linha 1 é o cabeçalho
+    for bloco in leitor:
+        if bloco.empty:
+            continue
+        yield bloco, linha
+        linha += len(bloco)
+
+
+def _normalizados(caminho, tamanho, pular, workers):
+    """Gera os blocos normalizados na ordem do arquivo, em paralelo se workers > 1."""
+    blocos = _ler_blocos(caminho, tamanho, pular)
+    if workers <= 1:
+        yield from map(normalizar_bloco, blocos)
+        return
+    # Executor.map consumiria o arquivo inteiro de uma vez; aqui só ficam
+    # 2 blocos por worker em voo, e os resultados saem na ordem do arquivo.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pendentes = deque()
+        for bloco in blocos:
+            pendentes.append(pool.submit(normalizar_bloco, bloco))
+            if len(pendentes) >= workers * 2:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+# --------------------
+# RESOLUÇÃO DE ESCOLAS / ALUNOS (processo principal)
+# --------------------
+
+
+class Resolvedor:
+    """Caches nome->id_escola e chave->id_aluno, criando o que faltar em lote."""
+
+    def __init__(self, regiao_padrao):
+        self.regiao_padrao = regiao_padrao
+        self.escolas = {nome: (id_escola, regiao) for id_escola, nome, regiao in
+                        db.session.query(Escola.id_escola, Escola.nome,
+                                         Escola.regiao_administrativa)}
+        self.alunos = {}
+        consulta = (db.session.query(Aluno.id_aluno, *[getattr(Aluno, c) for c in CHAVE_ALUNO])
+                    .execution_options(yield_per=10000))
+        for id_aluno, *chave in consulta:
+            self.alunos[tuple(chave)] = id_aluno
+
+    def resolver_escolas(self, nomes):
+        novas = [n for n in nomes if n not in self.escolas]
+        if novas:
+            registros = [dict(ENDERECO_NAO_INFORMADO, nome=n,
+                              regiao_administrativa=self.regiao_padrao) for n in novas]
+            ids = db.session.scalars(
+                insert(Escola).returning(Escola.id_escola, sort_by_parameter_order=True),
+                registros).all()
+            for nome, id_escola in zip(novas, ids):
+                self.escolas[nome] = (id_escola, self.regiao_padrao)
+        return len(novas)
+
+    def resolver_alunos(self, df):
+        """Adiciona a coluna id_aluno em `df`, criando os alunos que faltarem."""
+        chaves = list(df[CHAVE_ALUNO].itertuples(index=False, name=None))
+        novas = list(dict.fromkeys(c for c in chaves if c not in self.alunos))
+        if novas:
+            regioes = {id_escola: regiao for id_escola, regiao in self.escolas.values()}
+            registros = [dict(zip(CHAVE_ALUNO, c), regiao_administrativa=regioes[c[3]])
+                         for c in novas]
+            ids = db.session.scalars(
+                insert(Aluno).returning(Aluno.id_aluno, sort_by_parameter_order=True),
+                registros).all()
+            self.alunos.update(zip(novas, ids))
+            resumos.alunos_em_lote(db.session.connection(), [c[3] for c in novas])
+        df['id_aluno'] = [self.alunos[c] for c in chaves]
+        return len(novas)
+
+
+# --------------------
+# CHECKPOINT
+# --------------------
+
+
+def _ler_checkpoint(chave):
+    checkpoint_legado.create(db.session.connection(), checkfirst=True)
+    linhas = db.session.execute(
+        select(checkpoint_legado.c.linhas_processadas)
+        .where(checkpoint_legado.c.arquivo == chave)).scalar()
+    db.session.commit()
+    return linhas or 0
+
+
+def _gravar_checkpoint(chave, linhas):
+    """Grava o progresso na transação da sessão (confirmado junto com o bloco)."""
+    valores = {'linhas_processadas': linhas, 'atualizado_em': datetime.now()}
+    gravadas = db.session.execute(
+        update(checkpoint_legado).where(checkpoint_legado.c.arquivo == chave)
+        .values(valores)).rowcount
+    if not gravadas:
+        db.session.execute(insert(checkpoint_legado).values(arquivo=chave, **valores))
+
+
+# --------------------
+# MAIN
+# --------------------
+
+
+def migrar(arquivo, tamanho_bloco, workers, checkpoint, regiao_padrao, rejeitados_path):
+    pular = _ler_checkpoint(checkpoint)
+    if pular:
+        print(f"Retomando a partir da linha {pular + 2} (checkpoint {checkpoint!r}).")
+
+    resolvedor = Resolvedor(regiao_padrao)
+    processadas = pular
+    totais = {'exames': 0, 'escolas': 0, 'alunos': 0, 'rejeitadas': 0}
+    inicio = time.time()
+
+    rejeitados_f = open(rejeitados_path, 'a', encoding='utf-8') if rejeitados_path else None
+    try:
+        for normalizado, rejeitados in _normalizados(arquivo, tamanho_bloco, pular, workers):
+            # escolas, alunos, exames e checkpoint do bloco vão na mesma transação
+            processadas += len(normalizado) + len(rejeitados)
+            _gravar_checkpoint(checkpoint, processadas)
+            totais['escolas'] += resolvedor.resolver_escolas(normalizado['escola'].unique())
+            normalizado['id_escola'] = normalizado['escola'].map(
+                lambda n: resolvedor.escolas[n][0])
+            totais['alunos'] += resolvedor.resolver_alunos(normalizado)
+            totais['exames'] += carregar_lote(normalizado[COLUNAS_EXAME])
+            db.session.commit()  # bloco sem exames válidos: carregar_lote não confirma
+
+            totais['rejeitadas'] += len(rejeitados)
+            if rejeitados_f and rejeitados:
+                rejeitados_f.write(''.join(f"{n}\n" for n in rejeitados))
+                rejeitados_f.flush()
+
+            taxa = (processadas - pular) / max(time.time() - inicio, 1e-9)
+            print(f"{processadas} linhas • {totais['exames']} exames • "
+                  f"{totais['alunos']} alunos novos • {totais['escolas']} escolas novas • "
+                  f"{totais['rejeitadas']} rejeitadas • {taxa:,.0f} linhas/s")
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if rejeitados_f:
+            rejeitados_f.close()
+
+    print("Migração concluída.")
+    return totais
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('arquivo', help="CSV no formato antigo da tabela exames")
+    parser.add_argument('--db', default=os.environ.get('DATABASE_URL', URI_PADRAO),
+                        help="URI do banco de destino (padrão: $DATABASE_URL ou o do app)")
+    parser.add_argument('--bloco', type=int, default=50000, help="linhas por bloco")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="processos para normalizar os blocos")
+    parser.add_argument('--checkpoint',
+                        help="chave do progresso em migracao_legado_checkpoint "
+                             "(padrão: caminho absoluto do arquivo)")
+    parser.add_argument('--regiao-padrao', default='Não informada',
+                        help="região administrativa das escolas criadas pela migração")
+    parser.add_argument('--rejeitados', help="grava aqui os números das linhas rejeitadas")
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=args.db,
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+
+    with app.app_context():
+        migrar(args.arquivo,
+               tamanho_bloco=args.bloco,
+               workers=args.workers,
+               checkpoint=args.checkpoint or os.path.abspath(args.arquivo),
+               regiao_padrao=args.regiao_padrao,
+               rejeitados_path=args.rejeitados)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
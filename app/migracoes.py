@@ -0,0 +1,391 @@
+"""
+Migrações versionadas do esquema (substitui o db.create_all() no import do app).
+
+Cada migração é uma função registrada com @migracao(versao, descricao) e
+recebe a conexão e o dialeto. As versões aplicadas ficam na tabela
+schema_migracoes; `atualizar` aplica, em ordem, só as que faltam.
+
+Cada migração escreve o próprio DDL e a própria carga de dados, como eram na
+versão: não usa os modelos (models.py) nem funções dos outros módulos, que
+mudam com o código. Assim a versão N produz sempre o mesmo esquema; uma
+mudança nos modelos entra como uma migração nova.
+
+Migrações comuns rodam numa transação junto com o registro da versão. As
+marcadas com transacional=False (criação de índices) rodam em autocommit,
+o que permite CREATE INDEX CONCURRENTLY no PostgreSQL (--concorrente): o
+índice é construído sem bloquear escritas na tabela, com o banco em uso.
+
+Uso:
+    python migracoes.py status
+    python migracoes.py atualizar [--concorrente]
+    flask --app app migrar [--concorrente]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import (Boolean, Column, Date, DateTime, Float, ForeignKey, Integer, MetaData,
+                        String, Table, inspect, select, text)
+
+from dados.conexao import URI_PADRAO, criar_engine
+
+_meta = MetaData()
+schema_migracoes = Table(
+    'schema_migracoes', _meta,
+    Column('versao', Integer, primary_key=True),
+    Column('descricao', String(255), nullable=False),
+    Column('aplicada_em', DateTime, nullable=False),
+)
+
+MIGRACOES = []
+
+
+def migracao(versao, descricao, transacional=True):
+    """Registra uma função de migração."""
+    def registrar(funcao):
+        MIGRACOES.append((versao, descricao, transacional, funcao))
+        MIGRACOES.sort(key=lambda m: m[0])
+        return funcao
+    return registrar
+
+
+class Contexto:
+    """O que uma migração recebe: conexão, dialeto e se deve usar CONCURRENTLY."""
+
+    def __init__(self, conexao, concorrente):
+        self.conexao = conexao
+        self.dialeto = conexao.dialect.name
+        self.concorrente = concorrente and self.dialeto == 'postgresql'
+
+    def executar(self, sql, **params):
+        return self.conexao.execute(text(sql), params)
+
+    def criar_indice(self, nome, tabela, colunas, colunas_pg=None):
+        """
+        CREATE INDEX IF NOT EXISTS (CONCURRENTLY no PostgreSQL, se pedido).
+        `colunas_pg` permite uma definição específica para o PostgreSQL
+        (ex.: NULLS LAST, que o SQLite não aceita em índices).
+        """
+        definicao = colunas_pg if (colunas_pg and self.dialeto == 'postgresql') else colunas
+        if self.concorrente:
+            # um CONCURRENTLY interrompido deixa o índice INVALID; refaz do zero
+            invalido = self.executar(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :nome AND NOT i.indisvalid", nome=nome).first()
+            if invalido:
+                self.executar(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+        concorrente = 'CONCURRENTLY ' if self.concorrente else ''
+        self.executar(f"CREATE INDEX {concorrente}IF NOT EXISTS {nome} ON {tabela} ({definicao})")
+
+
+# --------------------
+# MIGRAÇÕES
+# --------------------
+
+
+@migracao(1, "tabelas base escola/aluno/exame")
+def _tabelas_base(ctx):
+    meta = MetaData()
+    Table(
+        'escola', meta,
+        Column('id_escola', Integer, primary_key=True, autoincrement=True),
+        Column('nome', String(255), nullable=False),
+        Column('logradouro', String(255), nullable=False),
+        Column('numero', String(10), nullable=False),
+        Column('complemento', String(255)),
+        Column('bairro', String(255), nullable=False),
+        Column('cidade', String(255), nullable=False),
+        Column('estado', String(2), nullable=False),
+        Column('cep', String(10), nullable=False),
+        Column('latitude', Float),
+        Column('longitude', Float),
+        Column('regiao_administrativa', String(30), nullable=False),
+    )
+    Table(
+        'aluno', meta,
+        Column('id_aluno', Integer, primary_key=True, autoincrement=True),
+        Column('nome', String(255), nullable=False),
+        Column('data_nascimento', Date, nullable=False),
+        Column('sexo', String(10), nullable=False),
+        Column('id_escola', Integer, ForeignKey('escola.id_escola'), nullable=False),
+        Column('regiao_administrativa', String(30), nullable=False),
+    )
+    Table(
+        'exame', meta,
+        Column('id_exame', Integer, primary_key=True, autoincrement=True),
+        Column('id_aluno', Integer, ForeignKey('aluno.id_aluno'), nullable=False),
+        Column('data_hora_escaneamento', DateTime),
+        *[Column(nome, Float) for nome in (
+            'raio_corneano_od_mm', 'eixo_querato_steeper_od', 'eixo_querato_flatter_od',
+            'se_direito', 'ds_direito', 'dc_direito')],
+        Column('axis_direito', Integer),
+        *[Column(nome, Float) for nome in (
+            'distancia_interpupilar_mm', 'input5', 'se_esquerdo', 'ds_esquerdo', 'dc_esquerdo')],
+        Column('axis_esquerdo', Integer),
+        *[Column(nome, Float) for nome in (
+            'raio_corneano_os_mm', 'eixo_querato_steeper_os', 'eixo_querato_flatter_os')],
+    )
+    meta.create_all(ctx.conexao, checkfirst=True)
+
+
+@migracao(2, "índices das listagens, filtros e dashboard", transacional=False)
+def _indices_iniciais(ctx):
+    # /exames: paginação por cursor (data DESC NULLS LAST, id DESC)
+    ctx.criar_indice('ix_exame_data_hora_id', 'exame',
+                     'data_hora_escaneamento DESC, id_exame DESC',
+                     colunas_pg='data_hora_escaneamento DESC NULLS LAST, id_exame DESC')
+    # JOIN exame->aluno, contagem de exames por aluno e 1º exame por aluno
+    ctx.criar_indice('ix_exame_id_aluno_data', 'exame', 'id_aluno, data_hora_escaneamento')
+    # JOIN aluno->escola e filtro por escola
+    ctx.criar_indice('ix_aluno_id_escola', 'aluno', 'id_escola, id_aluno')
+    # /alunos ordenado por nome (desempate por id)
+    ctx.criar_indice('ix_aluno_nome_id', 'aluno', 'nome, id_aluno')
+    ctx.criar_indice('ix_aluno_regiao', 'aluno', 'regiao_administrativa')
+    # filtros por região e listagens ordenadas por nome de escola
+    ctx.criar_indice('ix_escola_regiao_nome', 'escola', 'regiao_administrativa, nome')
+    ctx.criar_indice('ix_escola_nome', 'escola', 'nome')
+
+
+# 1º dia do mês da data do exame, por dialeto (carga inicial da migração 3)
+_MES_V3 = {
+    'postgresql': "CAST(date_trunc('month', ex.data_hora_escaneamento) AS DATE)",
+    'sqlite': "date(ex.data_hora_escaneamento, 'start of month')",
+    'mysql': "CAST(DATE_FORMAT(ex.data_hora_escaneamento, '%Y-%m-01') AS DATE)",
+    'mariadb': "CAST(DATE_FORMAT(ex.data_hora_escaneamento, '%Y-%m-01') AS DATE)",
+}
+
+
+@migracao(3, "tabelas-resumo por escola e por escola/mês")
+def _resumos(ctx):
+    meta = MetaData()
+    Table(
+        'resumo_escola', meta,
+        Column('id_escola', Integer, primary_key=True, autoincrement=False),
+        Column('alunos', Integer, nullable=False, default=0),
+        Column('exames', Integer, nullable=False, default=0),
+    )
+    Table(
+        'resumo_exame_mes', meta,
+        Column('id_escola', Integer, primary_key=True, autoincrement=False),
+        Column('mes', Date, primary_key=True),
+        Column('exames', Integer, nullable=False, default=0),
+    )
+    meta.create_all(ctx.conexao, checkfirst=True)
+
+    ctx.executar("DELETE FROM resumo_escola")
+    ctx.executar("DELETE FROM resumo_exame_mes")
+    ctx.executar("""
+        INSERT INTO resumo_escola (id_escola, alunos, exames)
+        SELECT e.id_escola,
+               COALESCE(a.alunos, 0),
+               COALESCE(x.exames, 0)
+        FROM escola e
+        LEFT JOIN (SELECT id_escola, COUNT(*) AS alunos
+                   FROM aluno GROUP BY id_escola) a ON a.id_escola = e.id_escola
+        LEFT JOIN (SELECT al.id_escola, COUNT(*) AS exames
+                   FROM exame ex JOIN aluno al ON al.id_aluno = ex.id_aluno
+                   GROUP BY al.id_escola) x ON x.id_escola = e.id_escola
+    """)
+    if ctx.dialeto not in _MES_V3:
+        raise NotImplementedError(f"banco não suportado: {ctx.dialeto}")
+    mes = _MES_V3[ctx.dialeto]
+    ctx.executar(f"""
+        INSERT INTO resumo_exame_mes (id_escola, mes, exames)
+        SELECT al.id_escola, {mes}, COUNT(*)
+        FROM exame ex JOIN aluno al ON al.id_aluno = ex.id_aluno
+        WHERE ex.data_hora_escaneamento IS NOT NULL
+        GROUP BY al.id_escola, {mes}
+    """)
+
+
+@migracao(4, "registro de alterações para caches incrementais")
+def _alteracoes(ctx):
+    meta = MetaData()
+    Table(
+        'alteracao', meta,
+        Column('seq', Integer, primary_key=True, autoincrement=True),
+        Column('tabela', String(20), nullable=False),
+        Column('id_registro', Integer, nullable=False),
+        Column('operacao', String(1), nullable=False),
+        Column('em', DateTime, nullable=False),
+        # no SQLite, sem AUTOINCREMENT os seq seriam reaproveitados após a poda
+        sqlite_autoincrement=True,
+    )
+    meta.create_all(ctx.conexao, checkfirst=True)
+    ctx.executar("CREATE INDEX IF NOT EXISTS ix_alteracao_em ON alteracao (em)")
+
+
+@migracao(5, "classificação de triagem gravada no exame (exame.critico)")
+def _triagem(ctx):
+    ctx.executar("ALTER TABLE exame ADD COLUMN critico BOOLEAN")
+    # carga inicial com as regras padrão da época (esférico ou cilíndrico
+    # acima de 4, nos dois olhos; NULL sem medidas). Com TRIAGEM_REGRAS
+    # configurado, rode depois `python triagem.py reclassificar`.
+    ctx.executar("""
+        UPDATE exame SET critico = CASE
+            WHEN se_direito IS NULL AND ds_direito IS NULL
+                 AND se_esquerdo IS NULL AND ds_esquerdo IS NULL THEN NULL
+            WHEN se_direito > 4 OR ds_direito > 4
+                 OR se_esquerdo > 4 OR ds_esquerdo > 4 THEN :sim
+            ELSE :nao
+        END
+    """, sim=True, nao=False)
+
+
+# tabelas antigas do dashboard (reescritas inteiras a cada "Salvar", por nome)
+_JORNADA_LEGADO = {
+    'alunos_criticos': ['exame_feito'],
+    'alunos_necessitam_oculos': ['necessidade_oculos', 'outras_patologias'],
+    'alunos_oculos_entregue': ['oculos_entregue'],
+}
+
+
+@migracao(6, "jornada do aluno por id_aluno (substitui as tabelas por nome do dashboard)")
+def _jornada(ctx):
+    meta = MetaData()
+    colunas = []
+    for etapa in ('exame_feito', 'necessidade_oculos', 'outras_patologias', 'oculos_entregue'):
+        colunas += [Column(etapa, Boolean, nullable=False, default=False),
+                    Column(f'{etapa}_em', DateTime)]
+    # aluno entra só como alvo da FK (já existe desde a migração 1)
+    Table('aluno', meta, Column('id_aluno', Integer, primary_key=True))
+    tabela = Table(
+        'jornada_aluno', meta,
+        Column('id_aluno', Integer, ForeignKey('aluno.id_aluno', ondelete='CASCADE'),
+               primary_key=True, autoincrement=False),
+        *colunas,
+        Column('atualizado_em', DateTime, nullable=False),
+    )
+    tabela.create(ctx.conexao, checkfirst=True)
+    existentes = set(inspect(ctx.conexao).get_table_names())
+    alunos = pd.read_sql(text("SELECT id_aluno, nome AS aluno FROM aluno"), ctx.conexao)
+    jornada = alunos[['id_aluno']]
+    for tabela, flags in _JORNADA_LEGADO.items():
+        if tabela not in existentes:
+            continue
+        # as tabelas antigas são por nome: a marcação vale para os homônimos
+        legado = pd.read_sql(text(f"SELECT aluno, {', '.join(flags)} FROM {tabela}"),
+                             ctx.conexao)
+        legado[flags] = legado[flags].fillna(False).astype(bool)
+        legado = legado.groupby('aluno', as_index=False)[flags].max()
+        jornada = jornada.merge(alunos.merge(legado, on='aluno')[['id_aluno', *flags]],
+                                on='id_aluno', how='left')
+    flags = [f for fs in _JORNADA_LEGADO.values() for f in fs if f in jornada]
+    if not flags:
+        return
+    jornada[flags] = jornada[flags].fillna(False).astype(bool)
+    jornada = jornada[jornada[flags].any(axis=1)]
+    agora = datetime.now()
+    linhas = []
+    for registro in jornada.to_dict('records'):
+        linha = {'id_aluno': int(registro['id_aluno']), 'atualizado_em': agora}
+        for flag in flags:
+            linha[flag] = bool(registro[flag])
+            linha[f'{flag}_em'] = agora if registro[flag] else None
+        linhas.append(linha)
+    if linhas:
+        ctx.conexao.execute(tabela.insert(), linhas)
+
+
+@migracao(7, "índice da última gravação da jornada (versão do cache do dashboard)",
+          transacional=False)
+def _indice_jornada(ctx):
+    ctx.criar_indice('ix_jornada_aluno_atualizado_em', 'jornada_aluno', 'atualizado_em')
+
+
+@migracao(8, "NOTIFY a cada gravação em exame/aluno/escola/jornada_aluno (PostgreSQL)")
+def _notificacoes(ctx):
+    # avisos para os caches do dashboard (canal e tabelas de
+    # dados/notificacoes.py); nos outros bancos o dashboard segue consultando
+    # a versão dos dados
+    if ctx.dialeto != 'postgresql':
+        return
+    ctx.executar("""
+        CREATE OR REPLACE FUNCTION notificar_alteracao() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('dados_alterados', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    for tabela in ('exame', 'aluno', 'escola', 'jornada_aluno'):
+        ctx.executar(f"DROP TRIGGER IF EXISTS tg_notificar_alteracao ON {tabela}")
+        # por statement: uma carga em lote gera um aviso, não um por linha
+        ctx.executar(f"""
+            CREATE TRIGGER tg_notificar_alteracao
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela}
+            FOR EACH STATEMENT EXECUTE PROCEDURE notificar_alteracao()
+        """)
+
+
+@migracao(9, "remove o resumo por escola/mês (sem leitores)")
+def _sem_resumo_mes(ctx):
+    ctx.executar("DROP TABLE IF EXISTS resumo_exame_mes")
+
+
+# --------------------
+# EXECUÇÃO
+# --------------------
+
+
+def _aplicadas(engine):
+    _meta.create_all(engine, tables=[schema_migracoes], checkfirst=True)
+    with engine.connect() as conexao:
+        return {v: (d, em) for v, d, em in conexao.execute(
+            select(schema_migracoes.c.versao, schema_migracoes.c.descricao,
+                   schema_migracoes.c.aplicada_em))}
+
+
+def status(engine):
+    """Lista (versao, descricao, aplicada_em | None) de todas as migrações conhecidas."""
+    aplicadas = _aplicadas(engine)
+    return [(v, d, aplicadas.get(v, (None, None))[1]) for v, d, _, _ in MIGRACOES]
+
+
+def atualizar(engine, concorrente=False, ate=None, log=print):
+    """Aplica, em ordem, as migrações pendentes (até a versão `ate`, se dada)."""
+    aplicadas = _aplicadas(engine)
+    feitas = []
+    for versao, descricao, transacional, funcao in MIGRACOES:
+        if versao in aplicadas or (ate is not None and versao > ate):
+            continue
+        log(f"Aplicando migração {versao:03d}: {descricao}")
+        registro = schema_migracoes.insert().values(
+            versao=versao, descricao=descricao, aplicada_em=datetime.now())
+        if transacional:
+            with engine.begin() as conexao:
+                funcao(Contexto(conexao, concorrente))
+                conexao.execute(registro)
+        else:
+            with engine.connect() as conexao:
+                conexao = conexao.execution_options(isolation_level='AUTOCOMMIT')
+                funcao(Contexto(conexao, concorrente))
+                conexao.execute(registro)
+        feitas.append(versao)
+    return feitas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrações do esquema do banco.")
+    parser.add_argument('comando', choices=('status', 'atualizar'), nargs='?', default='atualizar')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_URL', URI_PADRAO),
+                        help="URI do banco (padrão: $DATABASE_URL ou o do app)")
+    parser.add_argument('--concorrente', action='store_true',
+                        help="cria índices com CONCURRENTLY (PostgreSQL, banco em uso)")
+    parser.add_argument('--ate', type=int, help="para na versão indicada")
+    args = parser.parse_args(argv)
+
+    engine = criar_engine(args.db)
+    if args.comando == 'status':
+        for versao, descricao, em in status(engine):
+            marca = em.strftime('%Y-%m-%d %H:%M') if em else 'pendente'
+            print(f"{versao:03d}  {marca:<16}  {descricao}")
+    else:
+        feitas = atualizar(engine, concorrente=args.concorrente, ate=args.ate)
+        print(f"{len(feitas)} migração(ões) aplicada(s)." if feitas else "Esquema já atualizado.")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,8 @@ db = SQLAlchemy()
 # --------------------
 # MODELS
 # --------------------
+# Tabelas e índices são criados pelas migrações versionadas (migracoes.py);
+# mudanças de esquema entram lá como uma nova migração.
 
 
 class Escola(db.Model):
@@ -67,6 +69,71 @@ class Exame(db.Model):
     eixo_querato_steeper_os = db.Column(db.Float, nullable=True)
     eixo_querato_flatter_os = db.Column(db.Float, nullable=True)
 
+    # resultado das regras de triagem (triagem.py); NULL = sem medidas
+    critico = db.Column(db.Boolean, nullable=True)
+
     aluno = db.relationship('Aluno',
                             backref=db.backref('exames', lazy=True),
                             foreign_keys=[id_aluno])
+
+
+# --------------------
+# JORNADA DO ALUNO (editada no dashboard)
+# --------------------
+
+
+# etapas (colunas booleanas) da jornada, na ordem em que acontecem
+ETAPAS_JORNADA = ('exame_feito', 'necessidade_oculos', 'outras_patologias', 'oculos_entregue')
+
+
+class JornadaAluno(db.Model):
+    """
+    Etapas da jornada após a triagem, uma linha por aluno. Cada flag tem a
+    data em que foi marcada (NULL enquanto não marcada).
+    """
+    __tablename__ = 'jornada_aluno'
+    id_aluno = db.Column(db.Integer,
+                         db.ForeignKey('aluno.id_aluno', ondelete='CASCADE'),
+                         primary_key=True, autoincrement=False)
+    exame_feito = db.Column(db.Boolean, nullable=False, default=False)
+    exame_feito_em = db.Column(db.DateTime)
+    necessidade_oculos = db.Column(db.Boolean, nullable=False, default=False)
+    necessidade_oculos_em = db.Column(db.DateTime)
+    outras_patologias = db.Column(db.Boolean, nullable=False, default=False)
+    outras_patologias_em = db.Column(db.DateTime)
+    oculos_entregue = db.Column(db.Boolean, nullable=False, default=False)
+    oculos_entregue_em = db.Column(db.DateTime)
+    atualizado_em = db.Column(db.DateTime, nullable=False)
+
+
+# --------------------
+# RESUMOS (mantidos por resumos.py)
+# --------------------
+
+
+class ResumoEscola(db.Model):
+    """Total de alunos e de exames por escola."""
+    __tablename__ = 'resumo_escola'
+    id_escola = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    alunos = db.Column(db.Integer, nullable=False, default=0)
+    exames = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --------------------
+# ALTERAÇÕES (gravadas por alteracoes.py)
+# --------------------
+
+
+class Alteracao(db.Model):
+    """
+    Marcador de mudanças para caches incrementais (dashboard). Exames novos
+    não entram aqui: são detectados pelo id_exame acima da marca d'água.
+    """
+    __tablename__ = 'alteracao'
+    # no SQLite, sem AUTOINCREMENT os seq seriam reaproveitados após a poda
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    tabela = db.Column(db.String(20), nullable=False)
+    id_registro = db.Column(db.Integer, nullable=False)
+    operacao = db.Column(db.String(1), nullable=False)  # 'I', 'U' ou 'D'
+    em = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,252 @@
+"""
+Tabela-resumo mantida de forma incremental:
+
+  resumo_escola  (id_escola)  -> alunos, exames
+
+Lida pela lista de escolas do dashboard (dados.consultas.escolas, total de
+alunos) e pela verificação de consistência da base local (total de exames).
+
+Os contadores são atualizados na mesma transação da alteração:
+  - pelo ORM (init_resumos registra ganchos na sessão): cobre cadastro,
+    edição e exclusão de alunos e exames feitos pelas rotas do app;
+  - em lote, por exames_em_lote / alunos_em_lote, nas cargas que não passam
+    pelo ORM (importação de planilhas, migração do legado).
+
+Para reconciliar (ou depois de cargas diretas no banco, como o gerador de
+dados), `reconstruir` recalcula tudo a partir das tabelas base:
+    python resumos.py reconstruir
+    flask --app app reconstruir-resumos
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+
+from sqlalchemy import delete, event, func, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from dados.conexao import URI_PADRAO, criar_engine
+from models import Aluno, Escola, Exame, ResumoEscola
+
+# tamanho dos lotes de ids ao buscar a escola de cada aluno
+LOTE_IDS = 10000
+
+_escola = ResumoEscola.__table__
+
+
+class Deltas:
+    """Variações acumuladas de alunos/exames por escola."""
+
+    def __init__(self):
+        self.alunos = Counter()
+        self.exames = Counter()
+        self.escolas_removidas = set()
+
+    def exame(self, id_escola, sinal):
+        if id_escola is not None:
+            self.exames[id_escola] += sinal
+
+    def vazio(self):
+        return not (any(self.alunos.values()) or any(self.exames.values())
+                    or self.escolas_removidas)
+
+
+# --------------------
+# GRAVAÇÃO
+# --------------------
+
+
+def _somar(conexao, tabela, chaves, linhas, colunas):
+    """
+    Soma `colunas` das linhas (dicts) às já existentes, criando as que faltam.
+    Usa INSERT ... ON CONFLICT DO UPDATE (atômico por linha) no PostgreSQL e
+    no SQLite; nos demais, UPDATE e INSERT se nada foi atualizado.
+    """
+    if not linhas:
+        return
+    dialeto = conexao.dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        insert = (postgresql if dialeto == 'postgresql' else sqlite).insert
+        stmt = insert(tabela)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=chaves,
+            set_={c: tabela.c[c] + stmt.excluded[c] for c in colunas})
+        conexao.execute(stmt, linhas)
+        return
+    for linha in linhas:
+        filtro = [tabela.c[k] == linha[k] for k in chaves]
+        resultado = conexao.execute(
+            update(tabela).where(*filtro).values({c: tabela.c[c] + linha[c] for c in colunas}))
+        if resultado.rowcount == 0:
+            conexao.execute(tabela.insert().values(linha))
+
+
+def aplicar(conexao, deltas):
+    """Grava as variações de `deltas` no resumo (na transação de `conexao`)."""
+    escolas = set(deltas.alunos) | set(deltas.exames)
+    linhas = [{'id_escola': e, 'alunos': deltas.alunos[e], 'exames': deltas.exames[e]}
+              for e in sorted(escolas) if deltas.alunos[e] or deltas.exames[e]]
+    _somar(conexao, _escola, ['id_escola'], linhas, ['alunos', 'exames'])
+
+    if deltas.escolas_removidas:
+        removidas = sorted(deltas.escolas_removidas)
+        conexao.execute(delete(_escola).where(_escola.c.id_escola.in_(removidas)))
+
+
+def _escolas_dos_alunos(conexao, ids):
+    escolas = {}
+    ids = [int(i) for i in ids]
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = ids[i:i + LOTE_IDS]
+        escolas.update(conexao.execute(
+            select(Aluno.id_aluno, Aluno.id_escola).where(Aluno.id_aluno.in_(lote))).all())
+    return escolas
+
+
+def exames_em_lote(conexao, df):
+    """Conta no resumo os exames de `df` (coluna id_aluno)."""
+    if df.empty:
+        return
+    ids = df['id_aluno'].astype('int64')
+    escolas = _escolas_dos_alunos(conexao, ids.unique())
+    por_escola = ids.map(escolas).dropna().value_counts()
+
+    deltas = Deltas()
+    deltas.exames.update({int(e): int(n) for e, n in por_escola.items()})
+    aplicar(conexao, deltas)
+
+
+def alunos_em_lote(conexao, ids_escola):
+    """Conta no resumo alunos novos; `ids_escola` tem o id_escola de cada aluno."""
+    deltas = Deltas()
+    deltas.alunos.update(int(e) for e in ids_escola)
+    aplicar(conexao, deltas)
+
+
+# --------------------
+# GANCHOS DO ORM
+# --------------------
+
+
+def _anterior(obj, atributo):
+    """Valor de `atributo` como está no banco (antes das alterações pendentes)."""
+    estado = inspect(obj)
+    historico = estado.attrs[atributo].history
+    if historico.deleted:
+        return historico.deleted[0]
+    if historico.unchanged:
+        return historico.unchanged[0]
+    if historico.added and estado.persistent:
+        # atributo expirado (ex.: depois de um commit) e alterado sem ser lido:
+        # o valor antigo só está no banco
+        chave = dict(zip((c.key for c in estado.mapper.primary_key), estado.identity))
+        coluna = estado.mapper.local_table.c[atributo]
+        return estado.session.execute(select(coluna).filter_by(**chave)).scalar()
+    return getattr(obj, atributo)
+
+
+def _mudou(obj, *atributos):
+    estado = inspect(obj)
+    return any(estado.attrs[a].history.has_changes() for a in atributos)
+
+
+def _escola_do_aluno(sessao, id_aluno, aluno=None):
+    if aluno is None and id_aluno is not None:
+        aluno = sessao.get(Aluno, id_aluno)
+    return aluno.id_escola if aluno is not None else None
+
+
+def _antes_flush(sessao, contexto, instancias):
+    deltas = sessao.info.setdefault('resumos', Deltas())
+    with sessao.no_autoflush:
+        for obj in sessao.new:
+            if isinstance(obj, Exame):
+                deltas.exame(_escola_do_aluno(sessao, obj.id_aluno, obj.__dict__.get('aluno')),
+                             +1)
+            elif isinstance(obj, Aluno):
+                id_escola = obj.id_escola
+                if id_escola is None and obj.__dict__.get('escola') is not None:
+                    id_escola = obj.escola.id_escola
+                if id_escola is not None:
+                    deltas.alunos[id_escola] += 1
+
+        for obj in sessao.deleted:
+            if isinstance(obj, Exame):
+                deltas.exame(_escola_do_aluno(sessao, _anterior(obj, 'id_aluno')), -1)
+            elif isinstance(obj, Aluno):
+                deltas.alunos[_anterior(obj, 'id_escola')] -= 1
+            elif isinstance(obj, Escola):
+                deltas.escolas_removidas.add(obj.id_escola)
+
+        for obj in sessao.dirty:
+            if isinstance(obj, Exame) and _mudou(obj, 'id_aluno'):
+                deltas.exame(_escola_do_aluno(sessao, _anterior(obj, 'id_aluno')), -1)
+                deltas.exame(_escola_do_aluno(sessao, obj.id_aluno), +1)
+            elif isinstance(obj, Aluno) and _mudou(obj, 'id_escola'):
+                # aluno trocou de escola: ele e os exames dele mudam de linha
+                antiga, nova = _anterior(obj, 'id_escola'), obj.id_escola
+                deltas.alunos[antiga] -= 1
+                deltas.alunos[nova] += 1
+                exames = sessao.execute(select(func.count())
+                                        .where(Exame.id_aluno == obj.id_aluno)).scalar()
+                deltas.exames[antiga] -= exames
+                deltas.exames[nova] += exames
+
+
+def _depois_flush(sessao, contexto):
+    deltas = sessao.info.pop('resumos', None)
+    if deltas is not None and not deltas.vazio():
+        aplicar(sessao.connection(), deltas)
+
+
+def _descartar(sessao, *args):
+    sessao.info.pop('resumos', None)
+
+
+def init_resumos(db):
+    """Mantém os resumos atualizados a cada flush da sessão do Flask-SQLAlchemy."""
+    event.listen(db.session, 'before_flush', _antes_flush)
+    event.listen(db.session, 'after_flush', _depois_flush)
+    event.listen(db.session, 'after_soft_rollback', _descartar)
+
+
+# --------------------
+# RECONSTRUÇÃO
+# --------------------
+
+
+def reconstruir(conexao):
+    """Recalcula o resumo a partir de escola/aluno/exame (na transação de `conexao`)."""
+    if conexao.dialect.name == 'postgresql':
+        # segura os incrementos concorrentes até o fim da reconstrução
+        conexao.execute(text("LOCK TABLE resumo_escola IN EXCLUSIVE MODE"))
+    conexao.execute(delete(_escola))
+    conexao.execute(text("""
+        INSERT INTO resumo_escola (id_escola, alunos, exames)
+        SELECT e.id_escola,
+               COALESCE(a.alunos, 0),
+               COALESCE(x.exames, 0)
+        FROM escola e
+        LEFT JOIN (SELECT id_escola, COUNT(*) AS alunos
+                   FROM aluno GROUP BY id_escola) a ON a.id_escola = e.id_escola
+        LEFT JOIN (SELECT al.id_escola, COUNT(*) AS exames
+                   FROM exame ex JOIN aluno al ON al.id_aluno = ex.id_aluno
+                   GROUP BY al.id_escola) x ON x.id_escola = e.id_escola
+    """))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manutenção das tabelas-resumo.")
+    parser.add_argument('comando', choices=('reconstruir',))
+    parser.add_argument('--db', default=os.environ.get('DATABASE_URL', URI_PADRAO),
+                        help="URI do banco (padrão: $DATABASE_URL ou o do app)")
+    args = parser.parse_args(argv)
+
+    engine = criar_engine(args.db)
+    with engine.begin() as conexao:
+        reconstruir(conexao)
+    print("Resumos reconstruídos.")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Regras de triagem: decide se um exame é "crítico" (aluno indicado para
+exame oftalmológico).
+
+Cada faixa etária tem, para cada olho (od = direito, oe = esquerdo), o
+intervalo normal do esférico e do cilíndrico; um valor fora do intervalo em
+qualquer olho torna o exame crítico. A idade é a do aluno na data do exame.
+Exames sem nenhuma das quatro medidas ficam sem classificação (NULL).
+
+A classificação é vetorizada (NumPy sobre colunas inteiras) e gravada em
+exame.critico no momento da escrita:
+  - pelo ORM (init_triagem): exames incluídos/editados pelas rotas do app e
+    exames de alunos cuja data de nascimento mudou;
+  - em lote, por `classificar_lote`, na importação de planilhas;
+  - por `reclassificar`, que percorre a tabela inteira (depois de mudar as
+    regras, ou de cargas diretas no banco como o gerador de dados):
+        flask --app app reclassificar-exames
+        python triagem.py reclassificar
+
+As regras padrão mantêm o critério antigo do dashboard (esférico ou
+cilíndrico acima de 4), agora nos dois olhos. Para trocá-las, aponte
+TRIAGEM_REGRAS para um JSON no formato de REGRAS_PADRAO, por exemplo:
+
+    {"faixas": [
+        {"idade_min": 0, "idade_max": 8,
+         "od": {"esferico": [-1.5, 3.5], "cilindrico": [-1.5, 1.5]},
+         "oe": {"esferico": [-1.5, 3.5], "cilindrico": [-1.5, 1.5]}},
+        {"idade_min": 8, "idade_max": null,
+         "od": {"esferico": [-0.75, 2.0], "cilindrico": [-1.0, 1.0]},
+         "oe": {"esferico": [-0.75, 2.0], "cilindrico": [-1.0, 1.0]}}
+    ]}
+
+idade_max é exclusivo; null em qualquer limite significa "sem limite".
+"""
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, inspect, select, update
+
+from dados.conexao import URI_PADRAO, criar_engine
+from models import Aluno, Exame
+import alteracoes
+
+# tamanho dos blocos de exames lidos/atualizados por vez
+LOTE = 50000
+LOTE_IDS = 10000
+
+# coluna de exame de cada (olho, medida)
+COLUNAS = {
+    ('od', 'esferico'): 'se_direito',
+    ('od', 'cilindrico'): 'ds_direito',
+    ('oe', 'esferico'): 'se_esquerdo',
+    ('oe', 'cilindrico'): 'ds_esquerdo',
+}
+
+REGRAS_PADRAO = {
+    "faixas": [
+        {"idade_min": None, "idade_max": None,
+         "od": {"esferico": [None, 4.0], "cilindrico": [None, 4.0]},
+         "oe": {"esferico": [None, 4.0], "cilindrico": [None, 4.0]}},
+    ]
+}
+
+Faixa = namedtuple('Faixa', ['idade_min', 'idade_max', 'limites'])
+
+
+def _limite(valor):
+    return np.nan if valor is None else float(valor)
+
+
+def carregar_regras(config=None):
+    """
+    Converte a configuração (dict, caminho de JSON ou None = TRIAGEM_REGRAS /
+    padrão) em uma lista de Faixa, com limites {(olho, medida): (min, max)}.
+    """
+    if config is None:
+        config = os.environ.get('TRIAGEM_REGRAS') or REGRAS_PADRAO
+    if isinstance(config, str):
+        with open(config, encoding='utf-8') as f:
+            config = json.load(f)
+
+    faixas = []
+    for item in config['faixas']:
+        limites = {}
+        for olho, medida in COLUNAS:
+            minimo, maximo = item.get(olho, {}).get(medida, [None, None])
+            limites[(olho, medida)] = (_limite(minimo), _limite(maximo))
+        faixas.append(Faixa(_limite(item.get('idade_min')), _limite(item.get('idade_max')),
+                            limites))
+    if not faixas:
+        raise ValueError("As regras de triagem precisam de ao menos uma faixa.")
+    return faixas
+
+
+_regras = None
+
+
+def regras():
+    """Regras em uso (carregadas uma vez por processo)."""
+    global _regras
+    if _regras is None:
+        _regras = carregar_regras()
+    return _regras
+
+
+# --------------------
+# CLASSIFICAÇÃO
+# --------------------
+
+
+def idades(nascimento, data_exame):
+    """Idade em anos completos na data do exame (hoje, se o exame não tem data)."""
+    nascimento = pd.to_datetime(pd.Series(nascimento)).to_numpy(dtype='datetime64[D]')
+    data = pd.to_datetime(pd.Series(data_exame)).to_numpy(dtype='datetime64[D]')
+    data = np.where(np.isnat(data), np.datetime64(datetime.now().date(), 'D'), data)
+    # meses inteiros entre as datas, menos um se o dia do mês ainda não chegou
+    mes_nasc, mes_data = nascimento.astype('datetime64[M]'), data.astype('datetime64[M]')
+    meses = (mes_data - mes_nasc).astype(float)
+    meses -= (data - mes_data) < (nascimento - mes_nasc)
+    meses[np.isnat(nascimento)] = np.nan
+    return np.floor(meses / 12)
+
+
+def classificar(exames, nascimento, faixas=None):
+    """
+    Classifica os exames de `exames` (DataFrame com data_hora_escaneamento e
+    as colunas de COLUNAS); `nascimento` tem a data de nascimento do aluno de
+    cada linha, na mesma ordem. Retorna uma Series "boolean" alinhada a
+    `exames`: True = crítico, False = normal, <NA> = sem medidas.
+    """
+    faixas = faixas or regras()
+    # a idade (conversão de datas) só é calculada se alguma faixa a usa
+    idade = None
+    if any(not (np.isnan(f.idade_min) and np.isnan(f.idade_max)) for f in faixas):
+        idade = idades(nascimento, exames['data_hora_escaneamento'])
+    medidas = {chave: pd.to_numeric(exames[coluna], errors='coerce').to_numpy(dtype=float)
+               for chave, coluna in COLUNAS.items()}
+
+    critico = np.zeros(len(exames), dtype=bool)
+    for faixa in faixas:
+        na_faixa = np.ones(len(exames), dtype=bool)
+        if idade is not None:
+            # idade desconhecida (NaN) não entra em faixas com limite de idade
+            if not np.isnan(faixa.idade_min):
+                na_faixa &= idade >= faixa.idade_min
+            if not np.isnan(faixa.idade_max):
+                na_faixa &= idade < faixa.idade_max
+        for chave, (minimo, maximo) in faixa.limites.items():
+            valores = medidas[chave]
+            # comparações com NaN (medida ausente / sem limite) dão False
+            critico |= na_faixa & ((valores < minimo) | (valores > maximo))
+
+    medido = np.zeros(len(exames), dtype=bool)
+    for valores in medidas.values():
+        medido |= ~np.isnan(valores)
+    return pd.Series(pd.arrays.BooleanArray(critico, ~medido), index=exames.index)
+
+
+def classificar_exame(exame, nascimento):
+    """Classificação de um único exame (objeto Exame); True, False ou None."""
+    linha = pd.DataFrame([{
+        'data_hora_escaneamento': exame.data_hora_escaneamento,
+        **{coluna: getattr(exame, coluna) for coluna in COLUNAS.values()},
+    }])
+    resultado = classificar(linha, [nascimento]).iloc[0]
+    return None if pd.isna(resultado) else bool(resultado)
+
+
+def _nascimentos(conexao, ids_aluno):
+    nascimentos = {}
+    ids = [int(i) for i in ids_aluno]
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = ids[i:i + LOTE_IDS]
+        nascimentos.update(conexao.execute(
+            select(Aluno.id_aluno, Aluno.data_nascimento).where(Aluno.id_aluno.in_(lote))).all())
+    return nascimentos
+
+
+def classificar_lote(conexao, df):
+    """Classifica um lote de exames novos (com id_aluno), buscando as datas de nascimento."""
+    ids = df['id_aluno'].astype('int64')
+    nascimentos = _nascimentos(conexao, ids.unique())
+    return classificar(df, ids.map(nascimentos).to_numpy())
+
+
+# --------------------
+# RECLASSIFICAÇÃO
+# --------------------
+
+
+def _gravar(conexao, ids, valor):
+    tabela = Exame.__table__
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = [int(x) for x in ids[i:i + LOTE_IDS]]
+        conexao.execute(update(tabela).where(tabela.c.id_exame.in_(lote)).values(critico=valor))
+
+
+def reclassificar(conexao, registrar=True, faixas=None):
+    """
+    Reaplica as regras a todos os exames, em blocos de LOTE, e grava só os
+    que mudaram (um UPDATE ... IN por valor novo). Com `registrar`, os exames
+    alterados entram no registro de alterações, para os caches do dashboard.
+    Retorna quantos exames mudaram de classificação.
+    """
+    colunas = ['id_exame', 'data_hora_escaneamento', 'critico', *COLUNAS.values()]
+    x = Exame.__table__
+    a = Aluno.__table__
+    ultimo, mudaram = 0, 0
+    while True:
+        df = pd.read_sql(
+            select(*[x.c[c] for c in colunas], a.c.data_nascimento)
+            .join(a, a.c.id_aluno == x.c.id_aluno)
+            .where(x.c.id_exame > ultimo).order_by(x.c.id_exame).limit(LOTE),
+            conexao)
+        if df.empty:
+            break
+        ultimo = int(df['id_exame'].iloc[-1])
+
+        novo = classificar(df, df['data_nascimento'].to_numpy(), faixas)
+        atual = df['critico'].astype('boolean')
+        diferente = (novo != atual).fillna(True) & ~(novo.isna() & atual.isna())
+        for valor in (True, False, None):
+            alvo = novo.isna() if valor is None else (novo == valor).fillna(False)
+            ids = df.loc[diferente & alvo, 'id_exame'].tolist()
+            if ids:
+                _gravar(conexao, ids, valor)
+                if registrar:
+                    alteracoes.registrar(conexao, 'exame', ids)
+        mudaram += int(diferente.sum())
+    return mudaram
+
+
+# --------------------
+# GANCHOS DO ORM
+# --------------------
+
+
+def _mudou(obj, *atributos):
+    estado = inspect(obj)
+    return any(estado.attrs[a].history.has_changes() for a in atributos)
+
+
+def _nascimento(sessao, exame):
+    aluno = exame.__dict__.get('aluno')
+    if aluno is None and exame.id_aluno is not None:
+        aluno = sessao.get(Aluno, exame.id_aluno)
+    return aluno.data_nascimento if aluno is not None else None
+
+
+def _antes_flush(sessao, contexto, instancias):
+    atributos = ('id_aluno', 'data_hora_escaneamento', *COLUNAS.values())
+    with sessao.no_autoflush:
+        for obj in list(sessao.new) + list(sessao.dirty):
+            if isinstance(obj, Exame) and (obj in sessao.new or _mudou(obj, *atributos)):
+                obj.critico = classificar_exame(obj, _nascimento(sessao, obj))
+            elif isinstance(obj, Aluno) and obj not in sessao.new \
+                    and _mudou(obj, 'data_nascimento'):
+                # a idade mudou: os exames do aluno podem mudar de faixa
+                exames = sessao.execute(select(Exame).where(Exame.id_aluno == obj.id_aluno))
+                for exame in exames.scalars():
+                    exame.critico = classificar_exame(exame, obj.data_nascimento)
+
+
+def init_triagem(db):
+    """Classifica exames incluídos/alterados a cada flush da sessão do Flask-SQLAlchemy."""
+    event.listen(db.session, 'before_flush', _antes_flush)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classificação de triagem dos exames.")
+    parser.add_argument('comando', choices=('reclassificar',))
+    parser.add_argument('--db', default=os.environ.get('DATABASE_URL', URI_PADRAO),
+                        help="URI do banco (padrão: $DATABASE_URL ou o do app)")
+    args = parser.parse_args(argv)
+
+    engine = criar_engine(args.db)
+    with engine.begin() as conexao:
+        mudaram = reclassificar(conexao)
+    print(f"{mudaram} exame(s) reclassificado(s).")
+
+
+if __name__ == '__main__':
+    sys.exit(main())